@@ -0,0 +1,2 @@
+#wiki_vocab_test.py is a script that looks words up on Wikipedia, not a pytest test
+collect_ignore = ["wiki_vocab_test.py"]
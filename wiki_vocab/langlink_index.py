@@ -0,0 +1,172 @@
+"""
+Offline index of Wikipedia interlanguage links, built from the database dumps
+
+Download the page and langlinks tables of a wiki from https://dumps.wikimedia.org,
+e.g. enwiki-latest-page.sql.gz and enwiki-latest-langlinks.sql.gz, then run:
+
+    python langlink_index.py enwiki-latest-page.sql.gz enwiki-latest-langlinks.sql.gz langlinks.sqlite
+
+The dumps are streamed, so they never have to be uncompressed on disk. The
+index is an SQLite file of title -> page id and page id -> {lang: title},
+which wiki_vocab can answer from instead of the network (see enable_index).
+"""
+
+import argparse
+import bz2
+import gzip
+import os
+import re
+import sqlite3
+
+#A row of an INSERT statement: quoted strings (with backslash escapes) or bare values, in parentheses
+SQL_ROW = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+SQL_FIELD = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)")
+SQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+SQL_ESCAPE = re.compile(r"\\(.)")
+
+#Only articles are indexed, and redirects aren't (their langlinks belong to the target)
+ARTICLE_NAMESPACE = 0
+
+#Column order of the page table, for dumps without a CREATE TABLE statement
+#Older dumps have page_restrictions before page_is_redirect, so the header is read when there is one
+PAGE_COLUMNS = ['page_id', 'page_namespace', 'page_title', 'page_is_redirect']
+SQL_COLUMN = re.compile(r"\s+`(\w+)`")
+
+#Rows are written to the index this many at a time
+BATCH_SIZE = 100000
+
+def open_dump(path):
+    """Open a dump as text, uncompressing .gz and .bz2 files as they're read"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+def unescape(value):
+    return SQL_ESCAPE.sub(lambda match: SQL_ESCAPES.get(match.group(1), match.group(1)), value)
+
+def iter_rows(path, table):
+    """Yield the rows inserted into table by a SQL dump, as lists of strings (None for NULL)"""
+    prefix = 'INSERT INTO `{0}` VALUES '.format(table)
+    with open_dump(path) as source:
+        for line in source:
+            if not line.startswith(prefix):
+                continue
+            for row in SQL_ROW.finditer(line, len(prefix)):
+                fields = []
+                for quoted, bare in SQL_FIELD.findall(row.group(1)):
+                    if bare:
+                        fields.append(None if bare == 'NULL' else bare)
+                    else:
+                        fields.append(unescape(quoted))
+                yield fields
+
+def table_columns(path, table):
+    """Return the column names of table from the CREATE TABLE statement of a SQL dump,
+    or None if the dump doesn't have one
+    """
+    header = 'CREATE TABLE `{0}` ('.format(table)
+    columns = None
+    with open_dump(path) as source:
+        for line in source:
+            if line.startswith('INSERT INTO'):
+                break
+            if line.startswith(header):
+                columns = []
+            elif columns is not None:
+                column = SQL_COLUMN.match(line)
+                if not column:
+                    break
+                columns.append(column.group(1))
+    return columns or None
+
+def normalize_title(title):
+    """Write a title the way the dumps do: underscores for spaces, first letter capitalized"""
+    title = title.strip().replace(' ', '_')
+    return title[:1].upper() + title[1:]
+
+def batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def build_index(page_dump, langlinks_dump, index_path):
+    """Build the index from a page dump and a langlinks dump
+    The index is written to a temporary file and renamed at the end,
+    so a half-built index is never used
+    """
+    temp_path = index_path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    db = sqlite3.connect(temp_path)
+    #Nothing needs to survive a crash, since the file is only renamed when it's done
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE pages (title TEXT PRIMARY KEY, page_id INTEGER) WITHOUT ROWID")
+    db.execute("""CREATE TABLE langlinks (page_id INTEGER, lang TEXT, title TEXT,
+                  PRIMARY KEY (page_id, lang)) WITHOUT ROWID""")
+
+    #page: (page_id, page_namespace, page_title, page_is_redirect, ...)
+    columns = table_columns(page_dump, 'page') or PAGE_COLUMNS
+    redirect = columns.index('page_is_redirect')
+    pages = ((row[2], int(row[0])) for row in iter_rows(page_dump, 'page')
+             if int(row[1]) == ARTICLE_NAMESPACE and row[redirect] != '1')
+    for batch in batches(pages):
+        db.executemany("INSERT OR IGNORE INTO pages VALUES (?, ?)", batch)
+
+    #langlinks: (ll_from, ll_lang, ll_title)
+    langlinks = ((int(row[0]), row[1], row[2]) for row in iter_rows(langlinks_dump, 'langlinks') if row[2])
+    for batch in batches(langlinks):
+        db.executemany("INSERT OR IGNORE INTO langlinks VALUES (?, ?, ?)", batch)
+
+    db.commit()
+    db.close()
+    os.replace(temp_path, index_path)
+
+class LangLinkIndex:
+    """Look up the titles of a page in other languages from an index made by build_index"""
+    def __init__(self, index_path):
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(index_path)
+        self.db = sqlite3.connect('file:{0}?mode=ro'.format(index_path), uri=True, check_same_thread=False)
+        self.cache = {} #{title: {lang: title}}
+
+    def page_id(self, title):
+        """Return the page id of an article, or None if there's no such article"""
+        row = self.db.execute("SELECT page_id FROM pages WHERE title = ?", (normalize_title(title),)).fetchone()
+        return row[0] if row else None
+
+    def langlinks(self, title):
+        """Return {lang: title} of the versions of an article in other languages,
+        or None if there's no such article
+        """
+        if title not in self.cache:
+            page_id = self.page_id(title)
+            if page_id is None:
+                self.cache[title] = None
+            else:
+                self.cache[title] = dict(self.db.execute(
+                    "SELECT lang, title FROM langlinks WHERE page_id = ?", (page_id,)))
+        return self.cache[title]
+
+    def translate(self, title, lang):
+        """Return the title of an article in another language, or None"""
+        links = self.langlinks(title)
+        return links.get(lang) if links else None
+
+    def close(self):
+        self.db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an interlanguage link index from Wikipedia dumps")
+    parser.add_argument("page_dump", help="page table dump, e.g. enwiki-latest-page.sql.gz")
+    parser.add_argument("langlinks_dump", help="langlinks table dump, e.g. enwiki-latest-langlinks.sql.gz")
+    parser.add_argument("index", help="SQLite file to write the index to")
+    args = parser.parse_args()
+    build_index(args.page_dump, args.langlinks_dump, args.index)
@@ -0,0 +1,81 @@
+"""
+Tests of the offline interlanguage link index, built from the small dumps in fixtures/
+
+Run with: python -m pytest test_langlink_index.py
+"""
+import os
+
+import pytest
+
+import langlink_index
+import wiki_vocab
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+@pytest.fixture
+def index_path(tmp_path):
+    index_path = str(tmp_path / 'langlinks.sqlite')
+    langlink_index.build_index(os.path.join(FIXTURES, 'page.sql.gz'),
+                               os.path.join(FIXTURES, 'langlinks.sql.gz'), index_path)
+    return index_path
+
+@pytest.fixture
+def index(index_path):
+    index = langlink_index.LangLinkIndex(index_path)
+    yield index
+    index.close()
+
+@pytest.fixture
+def offline(index_path, monkeypatch):
+    """Enable the index in wiki_vocab, and record the words that would be looked up on the network"""
+    #Restored by monkeypatch when the test is done
+    monkeypatch.setattr(wiki_vocab, 'langlink_index', None)
+    index = wiki_vocab.enable_index(index_path)
+    looked_up = []
+    def no_page(keyword):
+        looked_up.append(keyword)
+        return None
+    monkeypatch.setattr(wiki_vocab, 'find_disamb_pages', no_page)
+    monkeypatch.setattr(wiki_vocab, 'find_single_page', no_page)
+    yield looked_up
+    index.close()
+
+def test_iter_rows():
+    rows = list(langlink_index.iter_rows(os.path.join(FIXTURES, 'page.sql.gz'), 'page'))
+    assert len(rows) == 8
+    #Escaped quotes, and commas and parentheses inside quotes, stay in the field
+    assert rows[1] == ['2', '0', "O'Reilly_(a,b)", '', '0', '80']
+    assert rows[4][3] is None
+    assert langlink_index.table_columns(os.path.join(FIXTURES, 'page.sql.gz'), 'page') == [
+        'page_id', 'page_namespace', 'page_title', 'page_restrictions', 'page_is_redirect', 'page_len']
+
+def test_build_index(index):
+    assert index.langlinks('Stack') == {'de': 'Stapelspeicher', 'fr': 'Pile (informatique)'}
+    assert index.translate("O'Reilly (a,b)", 'de') == "O'Reilly (a,b)"
+    assert index.translate('stack', 'fr') == 'Pile (informatique)'
+    #Only articles are indexed: the talk page (namespace 1) doesn't replace the article
+    assert index.page_id('Stack') == 1
+    #Redirects aren't indexed
+    assert index.page_id('Algorithms') is None
+    assert index.langlinks('Algorithms') is None
+    assert index.langlinks('Orphan') == {}
+
+def test_batch_find_offline(offline):
+    results = wiki_vocab.batch_find(['Stack', 'Algorithm', 'Stack'], 'de')
+    assert results == [('Stack', ['Stapelspeicher']), ('Algorithm', ['Algorithmus']),
+                       ('Stack', ['Stapelspeicher'])]
+    assert wiki_vocab.batch_find(['Stack'], 'es') == [('Stack', [])]
+    assert offline == []
+
+def test_batch_find_falls_back(offline):
+    #A redirect, a page with no langlinks, and a word with a disambiguation page
+    #all go to the network (which finds nothing here) instead of answering []
+    assert wiki_vocab.batch_find(['Algorithms', 'Orphan', 'Bank'], 'de') == []
+    assert offline == ['Algorithms', 'Algorithms', 'Orphan', 'Orphan', 'Bank', 'Bank']
+
+def test_batch_job_offline(offline, monkeypatch):
+    async def no_fetch(*args, **kwargs):
+        raise AssertionError('fetched a page')
+    monkeypatch.setattr(wiki_vocab.PageFetcher, 'fetch', no_fetch)
+    assert wiki_vocab.batch_job(['Stack'], ['de', 'fr', 'es'], policy='first') == [
+        ('Stack', 'de', ['Stapelspeicher']), ('Stack', 'fr', ['Pile (informatique)']), ('Stack', 'es', [])]
@@ -0,0 +1,285 @@
+"""
+Tests of the concurrent batch mode against a local stub of Wikipedia, so no network is needed
+
+Run with: python -m pytest test_wiki_vocab.py
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import wiki_vocab
+
+class StubWiki(BaseHTTPRequestHandler):
+    """Serves the pages in self.server.pages, counting the requests for each path"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+        if self.path in server.redirects:
+            self.send_response(301)
+            self.send_header('Location', server.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        page = server.pages.get(self.path)
+        if page is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        #Pages with validators answer conditional requests with 304 when they haven't changed
+        etag = server.etags.get(self.path)
+        last_modified = server.modified.get(self.path)
+        if_none_match = self.headers.get('If-None-Match')
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_none_match or if_modified_since:
+            with server.lock:
+                server.conditional.append((self.path, if_none_match, if_modified_since))
+        if (etag and if_none_match == etag) or (not etag and last_modified and if_modified_since == last_modified):
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = page.format(root=server.root).encode('utf-8')
+        #Held pages send their first held bytes, then wait for the test to let the rest go
+        held = server.held.get(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        if last_modified:
+            self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        if held:
+            self.wfile.write(body[:held])
+            self.wfile.flush()
+            server.release.wait(5)
+            with server.lock:
+                server.finished.add(self.path)
+            body = body[held:]
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            #The client stopped reading, as it should for a page that's done
+            pass
+
+    def log_message(self, *args):
+        pass
+
+def article(title, lang_links, bold):
+    links = ''.join('<li><a hreflang="{0}" href="{{root}}/{0}/{1}">{0}</a></li>'.format(lang, target)
+                    for lang, target in lang_links)
+    return ('<html><body><ul>{0}</ul><h1>{1}</h1><p>The <b>{2}</b> is here.</p></body></html>'
+            .format(links, title, bold))
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubWiki)
+    server.root = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.lock = threading.Lock()
+    server.hits = {}
+    server.redirects = {'/wiki/Stacks': '/wiki/Stack'}
+    server.etags = {}
+    server.modified = {}
+    server.conditional = []
+    server.held = {}
+    server.release = threading.Event()
+    server.finished = set()
+    server.pages = {
+        '/wiki/Stack': article('Stack', [('de', 'Stapelspeicher')], 'stack'),
+        '/wiki/Queue': article('Queue', [('de', 'Warteschlange'), ('fr', 'File')], 'queue'),
+        '/wiki/Tab': article('Tab', [('fr', 'Tabulation')], 'tab'),
+        '/de/Stapelspeicher': article('Stapelspeicher', [], 'Kellerspeicher'),
+        '/de/Warteschlange': article('Warteschlange', [], 'Puffer'),
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+def test_batch_find_concurrent(stub, monkeypatch):
+    monkeypatch.setattr(wiki_vocab, 'http_cache', None)
+    monkeypatch.setattr(wiki_vocab, 'langlink_index', None)
+    words = ['Queue', 'Missing', 'Stacks', 'Tab', 'Stack', 'Queue']
+    results = wiki_vocab.batch_find_concurrent(words, 'de', concurrency=4, base_url=stub.root + '/wiki/')
+
+    #Results keep the order of the word list, and words with no page are left out
+    assert results == [
+        ('Queue', ['Warteschlange', 'Puffer']),
+        ('Stacks', ['Stapelspeicher', 'Kellerspeicher']),
+        ('Tab', []),
+        ('Stack', ['Stapelspeicher', 'Kellerspeicher']),
+        ('Queue', ['Warteschlange', 'Puffer']),
+    ]
+    #The redirect was followed, and every URL was only fetched once, even for
+    #repeated words. /wiki/Stack is asked for both as itself and through the
+    #/wiki/Stacks redirect, which are different URLs
+    assert stub.hits.pop('/wiki/Stack') == 2
+    assert stub.hits['/wiki/Stacks'] == 1
+    assert stub.hits['/wiki/Missing'] == 1
+    assert set(stub.hits.values()) == {1}
+
+def disamb_page(title, hrefs):
+    links = ''.join('<li><a href="{0}">{1}</a></li>'.format(href, href[len('/wiki/'):]) for href in hrefs)
+    return '<html><body><h1>{0}</h1><p>It may mean:</p><ul>{1}</ul></body></html>'.format(title, links)
+
+@pytest.mark.parametrize('policy, vocab', [
+    ('first', ['Bank', 'Geldinstitut']),
+    ('best', ['Ufer', 'Flussufer']),
+    #Three candidates link to Ufer, which is only read and listed once
+    ('all', ['Bank', 'Geldinstitut', 'Ufer', 'Flussufer']),
+])
+def test_batch_job_policies(stub, monkeypatch, policy, vocab):
+    monkeypatch.setattr(wiki_vocab, 'http_cache', None)
+    monkeypatch.setattr(wiki_vocab, 'langlink_index', None)
+    stub.pages.update({
+        '/wiki/Bank_(disambiguation)': disamb_page('Bank', [
+            '/wiki/Bank_(finance)', '/wiki/Bank_(river)', '/wiki/Riverbank', '/wiki/Bank_(geography)']),
+        '/wiki/Bank_(finance)': article('Bank (finance)', [('de', 'Bank')], 'bank'),
+        '/wiki/Bank_(river)': article('Bank (river)', [('de', 'Ufer')], 'bank'),
+        '/wiki/Riverbank': article('Riverbank', [('de', 'Ufer')], 'riverbank'),
+        '/wiki/Bank_(geography)': article('Bank (geography)', [('de', 'Ufer'), ('fr', 'Rive')], 'bank'),
+        '/de/Bank': article('Bank', [], 'Geldinstitut'),
+        '/de/Ufer': article('Ufer', [], 'Flussufer'),
+    })
+    results = wiki_vocab.batch_job(['Bank', 'Queue'], ['de', 'fr'], policy=policy, base_url=stub.root + '/wiki/')
+    assert results[0] == ('Bank', 'de', vocab)
+    #Only one candidate has a French version, so every policy takes it (and Rive has no page)
+    assert results[1] == ('Bank', 'fr', [])
+    assert results[2:] == [('Queue', 'de', ['Warteschlange', 'Puffer']), ('Queue', 'fr', [])]
+    assert set(stub.hits.values()) == {1}
+
+def test_batch_find_headless(stub, monkeypatch):
+    monkeypatch.setattr(wiki_vocab, 'http_cache', None)
+    monkeypatch.setattr(wiki_vocab, 'langlink_index', None)
+    #Like wiki_vocab_test.py, but with the best policy, so nothing needs to be typed in
+    results = wiki_vocab.batch_find_concurrent(['Stack', 'Missing', 'Queue'], 'de', policy='best',
+                                               base_url=stub.root + '/wiki/')
+    assert results == [('Stack', ['Stapelspeicher', 'Kellerspeicher']), ('Queue', ['Warteschlange', 'Puffer'])]
+
+def test_missing_page_is_no_page(stub):
+    pool = wiki_vocab.ConnectionPool()
+    with pytest.raises(wiki_vocab.error.HTTPError):
+        pool.get(stub.root + '/wiki/Missing')
+    final_url, status, headers, body = pool.get(stub.root + '/wiki/Stacks')
+    assert final_url == stub.root + '/wiki/Stack'
+    assert b'<h1>Stack</h1>' in body
+    pool.close()
+
+class Clock:
+    """Stands in for the time module in wiki_vocab, moving a second on every call"""
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(wiki_vocab, 'time', clock)
+    return clock
+
+def test_cache_revalidates_after_ttl(stub, clock, tmp_path):
+    stub.etags['/wiki/Stack'] = '"v1"'
+    stub.modified['/wiki/Queue'] = 'Sat, 01 Jan 2022 00:00:00 GMT'
+    cache = wiki_vocab.HTTPCache(str(tmp_path), ttl=100)
+    pool = wiki_vocab.ConnectionPool()
+    for path in ('/wiki/Stack', '/wiki/Queue'):
+        cache.get(stub.root + path, pool.get)
+        #Young pages come from the cache
+        final_url, body = cache.get(stub.root + path, pool.get)
+        assert final_url == stub.root + path
+    assert (cache.downloads, cache.hits, cache.revalidations) == (2, 2, 0)
+    assert stub.hits == {'/wiki/Stack': 1, '/wiki/Queue': 1}
+
+    #Old pages are revalidated, with the ETag if there is one and the date if not
+    clock.now += 100
+    for path in ('/wiki/Stack', '/wiki/Queue'):
+        final_url, body = cache.get(stub.root + path, pool.get)
+        assert b'<h1>' + path[len('/wiki/'):].encode() + b'</h1>' in body
+    assert (cache.downloads, cache.hits, cache.revalidations) == (2, 2, 2)
+    assert stub.conditional == [('/wiki/Stack', '"v1"', None),
+                                ('/wiki/Queue', None, 'Sat, 01 Jan 2022 00:00:00 GMT')]
+    #Revalidating makes the page young again
+    cache.get(stub.root + '/wiki/Stack', pool.get)
+    assert cache.hits == 3
+
+    #A page that changed is downloaded again
+    clock.now += 100
+    stub.etags['/wiki/Stack'] = '"v2"'
+    stub.pages['/wiki/Stack'] = article('Stack', [], 'pile')
+    final_url, body = cache.get(stub.root + '/wiki/Stack', pool.get)
+    assert b'<b>pile</b>' in body
+    assert cache.downloads == 3
+    assert stub.hits['/wiki/Stack'] == 3
+
+    #Missing pages are cached too
+    for attempt in range(2):
+        with pytest.raises(wiki_vocab.error.HTTPError):
+            cache.get(stub.root + '/wiki/Missing', pool.get)
+    assert stub.hits['/wiki/Missing'] == 1
+    pool.close()
+    cache.close()
+
+def test_cache_evicts_least_recently_used(clock, tmp_path):
+    #Random bytes don't compress, so each page takes 1000 bytes of the cache
+    pages = {url: os.urandom(1000) for url in ('a', 'b', 'c', 'd')}
+    cache = wiki_vocab.HTTPCache(str(tmp_path), ttl=100, max_bytes=2500)
+    def fetch(url, headers):
+        return url, 200, {}, pages[url]
+    cache.get('a', fetch)
+    cache.get('b', fetch)
+    #Using a makes b the least recently used, so b goes when c is added
+    cache.get('a', fetch)
+    cache.get('c', fetch)
+    urls = [row[0] for row in cache.db.execute("SELECT url FROM pages ORDER BY url")]
+    assert urls == ['a', 'c']
+    assert cache.get('a', fetch) == ('a', pages['a'])
+    cache.get('d', fetch)
+    urls = [row[0] for row in cache.db.execute("SELECT url FROM pages ORDER BY url")]
+    assert urls == ['a', 'd']
+    assert cache.downloads == 4
+    cache.close()
+
+def long_article(title, lang_links, bold):
+    """An article with a long tail after the lead, like the rest of a real page"""
+    tail = '<p>More about {0}.</p>'.format(title) * 5000
+    return article(title, lang_links, bold).replace('</body>', tail + '</body>')
+
+def test_page_stops_after_lead(stub, monkeypatch):
+    monkeypatch.setattr(wiki_vocab, 'http_cache', None)
+    stub.pages['/wiki/Long'] = long_article('Long', [('de', 'Lang'), ('fr', 'Long')], 'long')
+    #Only the first two chunks are sent until the test is done, so open_page
+    #only returns if it stops reading once the title, lead and language links are in
+    stub.held['/wiki/Long'] = 2 * wiki_vocab.chunk_size
+    page = wiki_vocab.open_page(stub.root + '/wiki/Long')
+    assert '/wiki/Long' not in stub.finished
+    assert page.done
+    assert page.title == 'Long'
+    assert page.lead_bold == ['long']
+    assert [lang for lang, title, href in page.lang_links] == ['de', 'fr']
+
+def test_full_page_reads_everything():
+    body = long_article('Long', [('de', 'Lang')], 'long').format(root='').encode('utf-8')
+    chunks = list(wiki_vocab.body_chunks(body))
+    read = []
+    def counted():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+    page = wiki_vocab.parse_page(counted())
+    assert len(read) == 1 < len(chunks)
+    read = []
+    page = wiki_vocab.parse_page(counted(), full=True)
+    assert len(read) == len(chunks)
+    assert not page.done
+    assert page.title == 'Long'
@@ -1,11 +1,38 @@
 """
 WikiVocab: get vocabulary in other languages by checking Wikipedia titles
+
+For a whole vocabulary list, batch_find_concurrent looks the words up at the
+same time over a few kept-alive connections:
+
+    vocablist = batch_find_concurrent(['stack', 'queue'], 'de')
+
+base_url can point it at another server, e.g. a local stub for testing.
+
+batch_job runs without asking anything, for words × languages at once:
+
+    results = batch_job(['stack', 'queue'], ['de', 'zh'], policy='best')
+
+or from the command line: python wiki_vocab.py words.txt -l de zh -p best
+
+To keep downloaded pages on disk between runs, call enable_cache() first.
+To answer from an offline index of Wikipedia's interlanguage links instead
+(see langlink_index.py), call enable_index(index_path).
 """
 
-import re
-import urllib
-from urllib import request
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
+import codecs
+import difflib
+import http.client
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib import error, parse, request
+from langlink_index import LangLinkIndex
 
 #all wiki pages begin like this
 wiki_url = 'http://www.wikipedia.org/wiki/'
@@ -13,51 +40,196 @@ wiki_url = 'http://www.wikipedia.org/wiki/'
 #use this to look for disambiguation pages
 disamb_suffix = '_(disambiguation)'
 
+#how many pages the concurrent batch mode fetches at once
+default_concurrency = 10
+
+#most candidate pages fetched from a disambiguation page by the headless policies
+max_candidates = 20
+
+#pages are read and parsed this many bytes at a time
+chunk_size = 16 * 1024
+
+#give up on a request after this many seconds
+request_timeout = 30
+
+#where enable_cache keeps pages, how long before they're checked again (in seconds),
+#and how big the cache can get (in bytes of compressed pages)
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'wiki_vocab')
+default_cache_ttl = 7 * 24 * 60 * 60
+default_cache_size = 200 * 1024 * 1024
+
+#cache of downloaded pages, None until enable_cache is called
+http_cache = None
+
+#offline interlanguage links, None until enable_index is called
+langlink_index = None
+
 #ask user which word they want to find
 def get_keyword():
     keyword = input("What word should I look for? ")
     return keyword
 
+def page_url(base_url, title):
+    """URL of the page with the given title, with unsafe characters quoted"""
+    return base_url + parse.quote(title.replace(' ', '_'), safe="_()'-,.")
+
+def prompt_choice(options, question):
+    """Print numbered options and ask the user to choose one
+    Returns the index of the choice, or None if it's out of range
+    """
+    for i in range(len(options)):
+        print("{0}: {1}".format(i, options[i]))
+    choice = int(input(question))
+    if choice not in range(len(options)):
+        print("Sorry, that's not in the range.")
+        return None
+    return choice
+
+class WikiPage(HTMLParser):
+    """The parts of a wiki page that wiki_vocab uses, pulled out in one pass over the HTML
+        title: text of the first h1
+        lead_bold: bold words in the lead paragraph (the first p with any text)
+        lang_links: (lang, title, href) of each tag with an hreflang
+        wiki_links: hrefs of links to other wiki pages, skipping special pages like Help:
+    Unless full is True, the page is done as soon as the title and the lead
+    paragraph are read and the list of language links has ended, so the rest
+    of the page doesn't need to be read (see parse_page)
+    """
+    #Tags that can hold the list of language links
+    lang_list_tags = ('ul', 'ol', 'div', 'nav', 'head')
+
+    def __init__(self, full=False):
+        super().__init__()
+        self.full = full
+        self.done = False
+        self.title = None
+        self.lead_bold = []
+        self.lang_links = []
+        self.wiki_links = []
+
+        #Where we are in the page
+        self.title_text = None #list of text while in the title
+        self.paragraph_text = None #list of text while in a paragraph, until the lead is found
+        self.paragraph_bold = []
+        self.bold_text = None #list of text while in a b in that paragraph
+        self.lead_done = False
+        self.lang_list_done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        href = attrs.get('href')
+        if 'hreflang' in attrs:
+            self.lang_links.append((attrs['hreflang'], attrs.get('title'), href))
+            self.lang_list_done = False
+        if href and href.startswith('/wiki/') and not ':' in href:
+            self.wiki_links.append(href)
+
+        if tag == 'h1' and self.title is None:
+            self.title_text = []
+        elif tag == 'p' and not self.lead_done and self.paragraph_text is None:
+            self.paragraph_text = []
+            self.paragraph_bold = []
+        elif tag == 'b' and self.paragraph_text is not None:
+            self.bold_text = []
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == 'h1' and self.title_text is not None:
+            self.title = ''.join(self.title_text).strip()
+            self.title_text = None
+        elif tag == 'b' and self.bold_text is not None:
+            self.paragraph_bold.append(''.join(self.bold_text))
+            self.bold_text = None
+        elif tag == 'p' and self.paragraph_text is not None:
+            #Skip empty paragraphs, the lead is the first with some text
+            if ''.join(self.paragraph_text).strip():
+                self.lead_bold = self.paragraph_bold
+                self.lead_done = True
+            self.paragraph_text = None
+            self.bold_text = None
+        elif tag in self.lang_list_tags and self.lang_links:
+            self.lang_list_done = True
+
+        if not self.full and self.title is not None and self.lead_done and self.lang_list_done:
+            self.done = True
+
+    def handle_data(self, data):
+        if self.done:
+            return
+        if self.title_text is not None:
+            self.title_text.append(data)
+        if self.paragraph_text is not None:
+            self.paragraph_text.append(data)
+        if self.bold_text is not None:
+            self.bold_text.append(data)
+
+def parse_page(chunks, full=False):
+    """Parse a page from an iterable of byte chunks, stopping once it's done
+    Returns a WikiPage
+    """
+    page = WikiPage(full)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        page.feed(decoder.decode(chunk))
+        if page.done:
+            return page
+    page.feed(decoder.decode(b'', final=True))
+    page.close()
+    return page
+
+def body_chunks(body):
+    """Split a page that's already been downloaded into chunks for parse_page"""
+    return (body[start:start + chunk_size] for start in range(0, len(body), chunk_size))
+
+def open_page(url, full=False):
+    """Parse the page at url into a WikiPage, from http_cache if it's enabled
+    Without the cache, the download also stops once the page is done
+    """
+    if http_cache:
+        return parse_page(body_chunks(http_cache.get(url, urlopen_get)[1]), full)
+    with request.urlopen(url, timeout=request_timeout) as response:
+        return parse_page(iter(lambda: response.read(chunk_size), b''), full)
+
+def lang_hrefs(page, lang):
+    """List the links to versions of the page in the given language"""
+    return [href for link_lang, title, href in page.lang_links if link_lang == lang]
+
+def page_vocab(page):
+    """Get the vocabulary on a page: its title, then the bold words in its first paragraph"""
+    return [page.title] + page.lead_bold
+
 #find disambiguation pages for the vocabulary word
 def find_disamb_pages(keyword):
     #https:///en.wikipedia.org/keyword_(disambiguation)
     disamb_url = wiki_url + keyword + disamb_suffix
     try:
         #see if there's a disambiguation page for the vocabulary word
-        disamb_soup = BeautifulSoup(request.urlopen(disamb_url))
+        #read all of it, since we need all the links
+        disamb_page = open_page(disamb_url, full=True)
     except:
         """The print statement is just for debugging"""
         #print("Couldn't open {0}".format(disamb_url))
         pass
     else:
-        #Return a BeautifulSoup object of the disambiguation page
-        return disamb_soup
+        #Return a WikiPage of the disambiguation page
+        return disamb_page
 
-def choose_disamb_page(disamb_soup):
+def choose_disamb_page(disamb_page):
     """Choose a page from the disambiguation pages"""
     print("Which page do you want to check?")
 
-    #Get a list of all tags with links to wiki pages in the HTML
-    disamb_links = disamb_soup.html.find_all(href=re.compile(r"^/wiki/"))
-
-    #From the list above, get a list of the URLs
-    hrefs = [link['href'] for link in disamb_links if not ':' in link['href']]
-
-    #Print the list of links
-    for i in range(len(hrefs)):
-        print("{0}: {1}".format(i, hrefs[i]))
+    hrefs = disamb_page.wiki_links
 
     #Ask the user to choose one of the links
-    choice = int(input("Choose a number: "))
-
-    #In case user chooses weird number
-    if choice not in range(len(hrefs)):
-        print("Sorry, that's not in the range.")
-    else:
+    choice = prompt_choice(hrefs, "Choose a number: ")
+    if choice is not None:
         print("You chose {0}. Loading page...".format(hrefs[choice]))
 
         #Each link is a relative path starting with /wiki/, so start from index 6
-        return BeautifulSoup(request.urlopen(wiki_url + hrefs[choice][6:]))
+        return open_page(wiki_url + hrefs[choice][6:])
 
 def find_single_page(keyword):
     """Open the wikipedia page with the exact keyword as title
@@ -67,61 +239,77 @@ def find_single_page(keyword):
     single_page_title = wiki_url + keyword
     try:
         #try to open the page
-        single_page_soup = BeautifulSoup(request.urlopen(single_page_title))
+        single_page = open_page(single_page_title)
     except:
         """The print statement is just for debugging"""
         #print("Couldn't open {0}".format(single_page_title))
         pass
     else:
-        return single_page_soup
+        return single_page
 
-def choose_lang_page(soup):
+def choose_lang_page(page):
     """Get a list of possible languages, and get the title in the language chosen by the user"""
 
-    #Get all links with the "hreflang" attribute
-    langs = soup.html.find_all(lambda tag: tag.has_attr('hreflang'))
-
-    #From the list above, get a (title, link) tuple. The title includes the language name
-    lang_titles = [(lang['title'], lang['href']) for lang in langs if lang.has_attr('title')]
+    #From the links with the "hreflang" attribute, get a (title, link) tuple. The title includes the language name
+    lang_titles = [(title, href) for lang, title, href in page.lang_links if title is not None]
 
     #List the possible titles
     print("Found the following languages: ")
-    for i in range(len(lang_titles)):
-        print("{0}: {1}".format(i, lang_titles[i][0]))
 
     #Ask the user to choose a language
-    choice = int(input("Which language do you want? "))
-    if choice not in range(len(lang_titles)):
-        print("Sorry, that's not in the range.")
-    else:
+    choice = prompt_choice([title for title, href in lang_titles], "Which language do you want? ")
+    if choice is not None:
         print("You chose {0}. Loading page...".format(lang_titles[choice][1]))
         #Get the first h1 in the page, which is the title in the target language
-        return BeautifulSoup(request.urlopen(lang_titles[choice][1])).h1.string
+        return open_page(lang_titles[choice][1]).title
+
+def enable_index(index_path):
+    """Answer from an offline interlanguage link index (see langlink_index.py)
+    when it has the page, instead of going to the network
+    """
+    global langlink_index
+    langlink_index = LangLinkIndex(index_path)
+    return langlink_index
+
+def index_vocab(title, lang):
+    """Get the vocabulary for a page from langlink_index
+    Only titles are in the index, so this is the title in lang, or [] if there's none
+    Returns None if the index isn't enabled, doesn't have the page, or has no langlinks for it
+    (so the page is looked up on the network instead)
+    """
+    if langlink_index is None or not title:
+        return None
+    links = langlink_index.langlinks(title)
+    if not links:
+        return None
+    return [links[lang].replace('_', ' ')] if lang in links else []
+
+def index_word_vocab(word, lang):
+    """Get the vocabulary for a word from langlink_index, like index_vocab
+    Words with a disambiguation page return None, so the page is still chosen
+    from the disambiguation page first, as it is without the index
+    """
+    if langlink_index is None or not word or langlink_index.page_id(word + disamb_suffix) is not None:
+        return None
+    return index_vocab(word, lang)
 
-def  find_specific_lang(soup, lang):
+def  find_specific_lang(page, lang):
+    vocab = index_vocab(page.title, lang)
+    if vocab is not None:
+        if not vocab:
+            print("Language not found.")
+        return vocab
     vocab = []
-    result = soup.html.find_all(hreflang=lang)
+    result = lang_hrefs(page, lang)
     if len(result) == 1:
-        #return BeautifulSoup(request.urlopen(result[0]['href'])).h1.string
-        vocab.append(BeautifulSoup(request.urlopen(result[0]['href'])).h1.string)
-        synonyms = BeautifulSoup(request.urlopen(result[0]['href'])).find('p').find_all('b')
-        synonym_strings = [synonym.string for synonym in synonyms]
-        for synonym in synonym_strings:
-            vocab.append(synonym)
+        #Open the page once, and get both the title and the synonyms from it
+        vocab.extend(page_vocab(open_page(result[0])))
     elif len(result) > 1:
         print("Found the following pages: ")
-        for i in range(len(lang_result)):
-            print("{0}: {1}".format(i, result[i]['href']))
-        choice = int(input("Which page do you want? "))
-        if choice not in range(len(result)):
-            print("Sorry, that's not in the range.")
-        else:
-            print("You chose {0}. Loading page...".format(result[choice]['href']))
-            #return BeautifulSoup(request.urlopen(result[0]['href'])).h1.string
-            synonyms = BeautifulSoup(request.urlopen(result[0]['href'])).find('p').find_all('b')
-            synonym_strings = [synonym.string for synonym in synonyms]
-            for synonym in synonym_strings:
-                vocab.append(synonym)
+        choice = prompt_choice(result, "Which page do you want? ")
+        if choice is not None:
+            print("You chose {0}. Loading page...".format(result[choice]))
+            vocab.extend(page_vocab(open_page(result[choice])))
     else:
         print("Language not found.")
     return vocab
@@ -129,6 +317,12 @@ def  find_specific_lang(soup, lang):
 def batch_find(wordlist, lang_choice):
     vocablist = []
     for word in wordlist:
+        #The index has the page with the word as its title, so no pages need to be loaded
+        result = index_word_vocab(word, lang_choice)
+        if result is not None:
+            print("Found {0} in the index".format(word))
+            vocablist.append((word, result))
+            continue
         disamb = find_disamb_pages(word)
         page = find_single_page(word)
         if disamb:
@@ -142,9 +336,437 @@ def batch_find(wordlist, lang_choice):
             vocablist.append((word, result))
         else:
             #handle page not found at all
-            print("Sorry, couldn't find any pages for {0}".format(keyword))
+            print("Sorry, couldn't find any pages for {0}".format(word))
     return vocablist
 
+def urlopen_get(url, headers=None):
+    """GET url with urllib, in the same form as ConnectionPool.get
+    Returns (final url, status, headers, body), raising error.HTTPError for error statuses
+    """
+    try:
+        response = request.urlopen(request.Request(url, headers=headers or {}), timeout=request_timeout)
+    except error.HTTPError as e:
+        #urllib treats 304 Not Modified as an error, but the cache asked for it
+        if e.code == 304:
+            return url, 304, e.headers, b''
+        raise
+    with response:
+        return response.geturl(), response.status, response.headers, response.read()
+
+class HTTPCache:
+    """Disk cache of pages, keyed by URL
+    Pages younger than ttl seconds are used as they are. Older pages are
+    revalidated with If-None-Match/If-Modified-Since, and only downloaded
+    again if they changed. Missing pages (404 and 410) are cached too, since
+    most words have no disambiguation page.
+    Bodies are stored zlib-compressed in an SQLite file, and the least recently
+    used pages are evicted when the bodies add up to more than max_bytes.
+    """
+    missing_statuses = (404, 410)
+
+    def __init__(self, cache_dir=default_cache_dir, ttl=default_cache_ttl, max_bytes=default_cache_size):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'pages.sqlite'), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, final_url TEXT, status INTEGER, etag TEXT,
+                last_modified TEXT, fetched REAL, accessed REAL, size INTEGER, body BLOB)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        #How many requests went to the network, and how many were answered by the cache
+        self.downloads = 0
+        self.revalidations = 0
+        self.hits = 0
+
+    def lookup(self, url):
+        with self.lock:
+            return self.db.execute(
+                "SELECT final_url, status, etag, last_modified, fetched, body FROM pages WHERE url = ?",
+                (url,)).fetchone()
+
+    def touch(self, url, fetched=None):
+        """Mark a page as just used (and, after revalidating, just fetched)"""
+        now = time.time()
+        with self.lock, self.db:
+            if fetched is None:
+                self.db.execute("UPDATE pages SET accessed = ? WHERE url = ?", (now, url))
+            else:
+                self.db.execute("UPDATE pages SET accessed = ?, fetched = ? WHERE url = ?", (now, fetched, url))
+
+    def store(self, url, final_url, status, headers, body):
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, final_url, status, headers.get('ETag'), headers.get('Last-Modified'),
+                 now, now, len(compressed), compressed))
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used pages until the cache fits in max_bytes"""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self.db.execute("SELECT url, size FROM pages ORDER BY accessed").fetchall():
+            self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def answer(self, url, final_url, status, body):
+        """Return a cached page the way it was first answered"""
+        if status in self.missing_statuses:
+            raise error.HTTPError(url, status, 'Not Found (cached)', {}, None)
+        return final_url, zlib.decompress(body)
+
+    def get(self, url, fetch=urlopen_get):
+        """Get (final url, body) of the page at url
+        fetch(url, headers) does the actual request when the cache can't answer,
+        returning (final url, status, headers, body) like urlopen_get
+        """
+        entry = self.lookup(url)
+        headers = {}
+        if entry is not None:
+            final_url, status, etag, last_modified, fetched, body = entry
+            if time.time() - fetched < self.ttl:
+                self.hits += 1
+                self.touch(url)
+                return self.answer(url, final_url, status, body)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        try:
+            new_url, new_status, new_headers, new_body = fetch(url, headers)
+        except error.HTTPError as e:
+            if e.code in self.missing_statuses:
+                self.downloads += 1
+                self.store(url, url, e.code, e.headers or {}, b'')
+            raise
+        if new_status == 304 and entry is not None:
+            self.revalidations += 1
+            self.touch(url, fetched=time.time())
+            return self.answer(url, final_url, status, body)
+        self.downloads += 1
+        self.store(url, new_url, new_status, new_headers, new_body)
+        return new_url, new_body
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM pages")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def enable_cache(cache_dir=default_cache_dir, ttl=default_cache_ttl, max_bytes=default_cache_size):
+    """Cache every page wiki_vocab downloads, see HTTPCache"""
+    global http_cache
+    http_cache = HTTPCache(cache_dir, ttl, max_bytes)
+    return http_cache
+
+class ConnectionPool:
+    """Keep-alive HTTP connections, reused across requests to the same host
+    Safe to use from several threads, each request takes its own connection
+    """
+    def __init__(self, timeout=request_timeout, max_redirects=5):
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.idle = {} #{(scheme, host): [connections]}
+        self.lock = threading.Lock()
+
+    def connect(self, scheme, host):
+        """Take an idle connection to the host, or open a new one"""
+        with self.lock:
+            idle = self.idle.get((scheme, host))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def release(self, scheme, host, connection):
+        with self.lock:
+            self.idle.setdefault((scheme, host), []).append(connection)
+
+    def request(self, url, headers):
+        """GET url once, returning (status, headers, body)"""
+        parts = parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        #A kept-alive connection may have been closed by the server, so retry once on a new one
+        for attempt in range(2):
+            connection = self.connect(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=dict(headers, **{'Accept-Encoding': 'identity'}))
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(parts.scheme, parts.netloc, connection)
+            return response.status, response.headers, body
+
+    def get(self, url, headers=None):
+        """GET url, following redirects
+        Returns (final url, status, headers, body), raising error.HTTPError for error statuses
+        """
+        for redirect in range(self.max_redirects + 1):
+            status, response_headers, body = self.request(url, headers or {})
+            if status in (301, 302, 303, 307, 308) and response_headers.get('Location'):
+                url = parse.urljoin(url, response_headers['Location'])
+                continue
+            if status >= 400:
+                raise error.HTTPError(url, status, response_headers.get('Status', ''), response_headers, None)
+            return url, status, response_headers, body
+        raise error.HTTPError(url, status, 'Too many redirects', response_headers, None)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+class PageFetcher:
+    """Fetch pages concurrently from asyncio, at most concurrency at once
+    Each URL is only fetched once, later requests for it get the same result
+    """
+    def __init__(self, concurrency=default_concurrency, pool=None, cache=None):
+        self.pool = pool or ConnectionPool()
+        #Use the module's cache unless told otherwise
+        self.cache = cache or http_cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.downloads = {} #{url: task}
+
+    def get_body(self, url):
+        """Download a page, run in the executor so the event loop isn't blocked"""
+        if self.cache:
+            return self.cache.get(url, self.pool.get)
+        final_url, status, headers, body = self.pool.get(url)
+        return final_url, body
+
+    async def download(self, url):
+        async with self.semaphore:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.get_body, url)
+            except (OSError, http.client.HTTPException):
+                #Missing pages and network errors both mean there's no page
+                return None
+
+    async def fetch(self, url, full=False):
+        """Return (final url, WikiPage) of the page, or None if it couldn't be fetched"""
+        if url not in self.downloads:
+            self.downloads[url] = asyncio.ensure_future(self.download(url))
+        downloaded = await self.downloads[url]
+        if downloaded is None:
+            return None
+        final_url, body = downloaded
+        page = await asyncio.get_running_loop().run_in_executor(
+            self.executor, parse_page, body_chunks(body), full)
+        return final_url, page
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+def link_title(href):
+    """Title of the page a link goes to, from the last part of its path"""
+    return parse.unquote(parse.urlsplit(href).path.rstrip('/').rsplit('/', 1)[-1]).replace('_', ' ')
+
+def title_score(word, title):
+    """How well a page title matches the word, from 0 to 1"""
+    return difflib.SequenceMatcher(None, word.lower().replace('_', ' '), title.lower()).ratio()
+
+class FirstMatch:
+    """Resolution policy: take the first candidate"""
+    #Whether to fetch every candidate page of a disambiguation page before choosing
+    prefetch = True
+
+    async def choose(self, word, titles):
+        """Return the indices of the chosen titles"""
+        return [0] if titles else []
+
+class BestMatch:
+    """Resolution policy: take the candidate whose title scores best against the word
+    scorer(word, title) returns a number, higher is better (title_score by default)
+    """
+    prefetch = True
+
+    def __init__(self, scorer=title_score):
+        self.scorer = scorer
+
+    async def choose(self, word, titles):
+        if not titles:
+            return []
+        scores = [self.scorer(word, title) for title in titles]
+        return [scores.index(max(scores))]
+
+class AllMatches:
+    """Resolution policy: take every candidate"""
+    prefetch = True
+
+    async def choose(self, word, titles):
+        return list(range(len(titles)))
+
+class Interactive:
+    """Resolution policy: ask the user, one question at a time, like batch_find"""
+    prefetch = False
+
+    def __init__(self):
+        self.lock = None
+
+    async def choose(self, word, titles):
+        #Made here, so it belongs to the running event loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            choice = await asyncio.get_running_loop().run_in_executor(
+                None, prompt_choice, titles, "Which page do you want for {0}? ".format(word))
+        return [] if choice is None else [choice]
+
+#resolution policies by name
+policies = {'first': FirstMatch, 'best': BestMatch, 'all': AllMatches, 'interactive': Interactive}
+
+def make_policy(policy):
+    """Get a resolution policy from its name, or use it as it is"""
+    if isinstance(policy, str):
+        return policies[policy]()
+    return policy
+
+def disamb_candidates(word, hrefs):
+    """Links on a disambiguation page worth fetching: the ones with the word in their
+    title (or all of them, if none have it), at most max_candidates
+    """
+    hrefs = list(dict.fromkeys(hrefs))
+    matching = [href for href in hrefs if word.lower() in link_title(href).lower()]
+    return (matching or hrefs)[:max_candidates]
+
+async def find_lang_vocab(fetcher, word, lang, candidates, policy, choose_candidate):
+    """Get the vocabulary in one language from the candidate pages for a word
+    Inputs:
+        candidates: list of (url, WikiPage) of pages about the word
+        choose_candidate: whether the policy still has to choose between the candidates
+    Returns:
+        list of vocabulary from every chosen page in the language, each page once
+    """
+    if choose_candidate:
+        #Only pages that have a version in the language are worth choosing
+        candidates = [(url, page) for url, page in candidates if lang_hrefs(page, lang)]
+        chosen = await policy.choose(word, [page.title or url for url, page in candidates])
+        candidates = [candidates[i] for i in chosen]
+
+    lang_urls = []
+    for url, page in candidates:
+        links = [(parse.urljoin(url, href), title or link_title(href))
+                 for link_lang, title, href in page.lang_links if link_lang == lang]
+        if len(links) > 1:
+            chosen = await policy.choose(word, [title for link_url, title in links])
+            links = [links[i] for i in chosen]
+        lang_urls.extend(link_url for link_url, title in links)
+
+    if not lang_urls:
+        print("Language {0} not found for {1}.".format(lang, word))
+        return []
+
+    #Candidates often link to the same page, which only needs to be read once,
+    #and links that redirect to the same page only add its vocabulary once
+    lang_urls = list(dict.fromkeys(lang_urls))
+    vocab = []
+    seen_urls = set()
+    for lang_page in await asyncio.gather(*[fetcher.fetch(lang_url) for lang_url in lang_urls]):
+        if lang_page and lang_page[0] not in seen_urls:
+            seen_urls.add(lang_page[0])
+            vocab.extend(page_vocab(lang_page[1]))
+    return vocab
+
+async def find_word_concurrent(fetcher, word, langs, base_url, policy):
+    """Look up one word in each of langs, with fetcher's pages
+    The English pages are found once and shared by all the languages
+    Returns a dict of {lang: list of vocabulary}, or None if there's no page for the word
+    """
+    indexed = {lang: index_word_vocab(word, lang) for lang in langs}
+    if indexed and None not in indexed.values():
+        print("Found {0} in the index".format(word))
+        return indexed
+
+    #Look for both kinds of page at once
+    disamb, page = await asyncio.gather(
+        fetcher.fetch(page_url(base_url, word + disamb_suffix), full=True),
+        fetcher.fetch(page_url(base_url, word)))
+    choose_candidate = False
+    if disamb:
+        print("Found a disambiguation page for {0}".format(word))
+        disamb_url, disamb_page = disamb
+        if policy.prefetch:
+            #Fetch the candidates at once, and choose between them for each language
+            hrefs = disamb_candidates(word, disamb_page.wiki_links)
+            choose_candidate = True
+        else:
+            hrefs = disamb_page.wiki_links
+            hrefs = [hrefs[i] for i in await policy.choose(word, hrefs)]
+        pages = await asyncio.gather(*[fetcher.fetch(parse.urljoin(disamb_url, href)) for href in hrefs])
+        candidates = [page for page in pages if page]
+    elif page:
+        print("Found a regular page for {0}".format(word))
+        candidates = [page]
+    else:
+        #handle page not found at all
+        print("Sorry, couldn't find any pages for {0}".format(word))
+        return None
+
+    vocabs = await asyncio.gather(*[
+        find_lang_vocab(fetcher, word, lang, candidates, policy, choose_candidate) for lang in langs])
+    return dict(zip(langs, vocabs))
+
+async def batch_job_async(wordlist, langs, policy='best', concurrency=default_concurrency, base_url=wiki_url):
+    """Look up every word in wordlist in every language in langs, all at the same time
+    Inputs:
+        policy: how to choose between candidate pages, a name in policies or a policy object
+    Returns:
+        list of (word, lang, vocab) in the order of wordlist and langs, skipping words with no page
+    """
+    policy = make_policy(policy)
+    fetcher = PageFetcher(concurrency)
+    try:
+        results = await asyncio.gather(*[
+            find_word_concurrent(fetcher, word, langs, base_url, policy) for word in wordlist])
+    finally:
+        fetcher.close()
+    return [(word, lang, result[lang]) for word, result in zip(wordlist, results)
+            if result is not None for lang in langs]
+
+def batch_job(wordlist, langs, policy='best', concurrency=default_concurrency, base_url=wiki_url):
+    """Look up words × languages without asking anything (see batch_job_async)"""
+    return asyncio.run(batch_job_async(wordlist, langs, policy, concurrency, base_url))
+
+async def batch_find_async(wordlist, lang_choice, concurrency=default_concurrency, base_url=wiki_url,
+                           policy='interactive'):
+    """Look up every word in wordlist at the same time
+    Returns a list of (word, vocab) in the order of wordlist, skipping words with no page
+    """
+    results = await batch_job_async(wordlist, [lang_choice], policy, concurrency, base_url)
+    return [(word, vocab) for word, lang, vocab in results]
+
+def batch_find_concurrent(wordlist, lang_choice, concurrency=default_concurrency, base_url=wiki_url,
+                          policy='interactive'):
+    """batch_find, with the lookups done concurrently (see batch_find_async)"""
+    return asyncio.run(batch_find_async(wordlist, lang_choice, concurrency, base_url, policy))
+
 def find_vocab():
     lang_choice = input("Which language (two-char abbreviation)?: ")
     keyword = get_keyword()
@@ -165,3 +787,25 @@ def find_vocab():
         print(result)
     else:
         print("Sorry, couldn't find any pages for {0}".format(keyword))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find vocabulary in other languages from Wikipedia titles")
+    parser.add_argument("words", help="file with one word per line")
+    parser.add_argument("-l", "--langs", nargs="+", required=True,
+                        help="languages to look for (two-char abbreviations)")
+    parser.add_argument("-p", "--policy", choices=sorted(policies), default="best",
+                        help="how to choose between candidate pages")
+    parser.add_argument("-j", "--concurrency", type=int, default=default_concurrency)
+    parser.add_argument("-c", "--cache", action="store_true",
+                        help="keep downloaded pages on disk between runs")
+    parser.add_argument("-i", "--index", help="offline interlanguage link index to answer from")
+    args = parser.parse_args()
+
+    with open(args.words) as source:
+        wordlist = [line.strip() for line in source if line.strip()]
+    if args.cache:
+        enable_cache()
+    if args.index:
+        enable_index(args.index)
+    for word, lang, vocab in batch_job(wordlist, args.langs, args.policy, args.concurrency):
+        print("{0}\t{1}\t{2}".format(word, lang, ", ".join(term for term in vocab if term)))
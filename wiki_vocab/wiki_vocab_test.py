@@ -1,5 +1,8 @@
 import wiki_vocab as wv
 
+#keep the pages between runs, so running again doesn't download them again
+wv.enable_cache()
+
 list1 = ['stack', 'queue', 'tree', 'algorithm', 'tab']
 list2 = ['object', 'semantics', 'comma', 'trombone', 'recursion']
 lang1 = 'de'
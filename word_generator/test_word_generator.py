@@ -0,0 +1,113 @@
+"""
+Tests of the word space, sound changes and phonotactics, on small made-up phonologies
+
+Run with: python -m pytest test_word_generator.py
+"""
+import itertools
+
+import pytest
+
+import word_generator as wg
+
+INITIALS = ["", "p", "s", "ps"]
+MEDIALS = ["a", "i"]
+FINALS = ["", "p", "s"]
+
+def syllables():
+    return ["".join(syllable) for syllable in itertools.product(INITIALS, MEDIALS, FINALS)]
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100, 1000])
+def test_feistel_is_a_permutation(size):
+    for seed in (0, 1, 2):
+        permutation = wg.FeistelPermutation(size, seed)
+        assert sorted(permutation.permute(index) for index in range(size)) == list(range(size))
+
+def test_feistel_seed_changes_order():
+    orders = [[wg.FeistelPermutation(100, seed).permute(index) for index in range(100)] for seed in (0, 1)]
+    assert orders[0] != orders[1]
+    assert orders[0] == [wg.FeistelPermutation(100, 0).permute(index) for index in range(100)]
+
+def test_lexicon_space_order():
+    space = wg.LexiconSpace(INITIALS, MEDIALS, FINALS, 1, 3)
+    # Shortest words first, and itertools.product order within a length
+    expected = ["".join(syls) for num_syls in range(1, 4)
+                for syls in itertools.product(syllables(), repeat=num_syls)]
+    assert space.size == len(expected)
+    assert list(space) == expected
+    with pytest.raises(IndexError):
+        space.word(space.size)
+
+def test_lexicon_space_sample():
+    space = wg.LexiconSpace(INITIALS, MEDIALS, FINALS, 1, 2)
+    words = list(space.sample(seed=3))
+    # Every distinct spelling once, even though several numbers spell some words
+    assert len(words) == len(set(words))
+    assert set(words) == set(space)
+    assert len(words) < space.size
+    assert words == list(space.sample(seed=3))
+
+@pytest.fixture
+def sound_changes():
+    classes = {
+        "V": ["a", "e", "i", "ai"],
+        "P": ["p", "t", "k"],
+        "B": ["b", "d", "g"],
+        "L": ["p", "b", "m"],
+    }
+    return lambda: wg.SoundChanges([
+        wg.SoundChange("P", "B", "V", "V", classes),
+        wg.SoundChange("s", "h", "V", "V", classes),
+        wg.SoundChange("h", "", "#", "", classes),
+        wg.SoundChange("B", "P", "", "#", classes),
+        wg.SoundChange("n", "m", "", "- L", classes),
+    ])
+
+def test_sound_changes(sound_changes):
+    changes = sound_changes()
+    # Class to class between vowels, including a two-letter vowel
+    assert changes.apply("aitai") == "aidai"
+    assert changes.apply("asa") == "aha"
+    # Word boundaries: h only goes at the start (the h from s comes first, and stays),
+    # and b only devoices at the end
+    assert changes.apply("hasa") == "aha"
+    assert changes.apply("bab") == "bap"
+    # A morpheme boundary in the context, which also keeps p and t from being between vowels
+    assert changes.apply("an-pa") == "am-pa"
+    assert changes.apply("an-ta") == "an-ta"
+    assert changes.apply("anpa") == "anpa"
+
+def test_apply_batch_matches_apply(sound_changes):
+    words = ["aitai", "asa", "hasa", "bab", "an-pa", "an-ta", "ha", "ah", "ba", "ab",
+             "tata", "asa", "sas", "hih", "ga", "dag", "en-me", "aba"]
+    batch = sound_changes().apply_batch(words)
+    one_by_one = sound_changes()
+    assert batch == [one_by_one.apply(word) for word in words]
+    # Contexts and boundaries don't reach across the words of a batch
+    assert sound_changes().apply_batch(["ab", "ha", "a", "ta"]) == ["ap", "a", "a", "ta"]
+
+def brute_segmentations(word, min_syls, max_syls):
+    """Count the ways to spell word with syllables, by listing every sequence"""
+    spellings = [syllable for syllable in itertools.product(INITIALS, MEDIALS, FINALS)]
+    return sum(1 for num_syls in range(min_syls, max_syls + 1)
+               for syls in itertools.product(spellings, repeat=num_syls)
+               if "".join("".join(syllable) for syllable in syls) == word)
+
+@pytest.mark.parametrize("word", ["a", "apsa", "psaps", "asa", "apa", "pspa", "aaa", "ipsips", "sp", ""])
+def test_count_segmentations(word):
+    phonotactics = wg.Phonotactics(INITIALS, MEDIALS, FINALS, 1, 3)
+    assert phonotactics.count_segmentations(word) == brute_segmentations(word, 1, 3)
+
+def test_segment():
+    phonotactics = wg.Phonotactics(INITIALS, MEDIALS, FINALS, 1, 3)
+    # apsa splits as a.psa or ap.sa
+    assert phonotactics.count_segmentations("apsa") == 2
+    syllables = phonotactics.segment("apsa")
+    assert len(syllables) == 2
+    assert "".join("".join(syllable) for syllable in syllables) == "apsa"
+    assert all(syllable[0] in INITIALS and syllable[1] in MEDIALS and syllable[2] in FINALS
+               for syllable in syllables)
+    # Too many syllables, and sounds the phonology doesn't have
+    assert phonotactics.segment("aaaa") is None
+    assert phonotactics.count_segmentations("aaaa") == 0
+    assert not phonotactics.is_valid("apta")
+    assert phonotactics.validate_batch(["a", "sp"]) == [("a", [("", "a", "")]), ("sp", None)]
@@ -17,11 +17,37 @@ LANG_NAME should correspond to the filename of your phonology/morphology files
 MAX_SYL is the maximum syllable lengths of words in your language
 
 Then run python word_generator.py from the command line.
+
+The language is compiled to constraints/<LANG_NAME>.language.pickle and reused
+on later runs until the csvs change (use --rebuild to make a new one anyway).
+
+To run the sound changes in constraints/<LANG_NAME>_sound_changes.csv (with
+the phoneme classes in <LANG_NAME>_sound_classes.csv) over the new words and
+morphemes, add --lenite.
+
+To check a word list (any csv with a Word column, like a language template)
+against the phonology, run python word_generator.py --check words.csv
+
+To also write a large generated corpus as sharded JSONL (or TSV) files:
+
+python word_generator.py --corpus 1000000 --corpus-dir corpus --seed 1 --workers 8
+
+The corpus is the same for the same --seed and --workers.
 """
 
+import argparse
+import bisect
 import random
 import csv
+import json
+import hashlib
+import itertools
+import multiprocessing
 import os
+import pickle
+import re
+
+import numpy
 
 # Name of the language in the phonology and morphology templates
 LANG_NAME = "lang01"
@@ -36,11 +62,37 @@ CONSTRAINTS_DIR = os.path.join(os.curdir,"constraints")
 # DEFINITION_LIST if we're just making up random words
 DEFINITION_LIST = range(100)
 
+# Compiled languages are saved as <LANG_NAME><LANGUAGE_EXT> in CONSTRAINTS_DIR
+# Bump LANGUAGE_VERSION when what's saved in them changes
+LANGUAGE_EXT = ".language.pickle"
+LANGUAGE_VERSION = 1
+
 # Actual word list
 WORD_LIST_FNAME = os.path.join(CONSTRAINTS_DIR, "basic_word_list.csv")
 
 PUNCTUATION = [".",","]
 
+# Random tries at a new word before going through the unused words in order
+MAX_RETRIES = 100
+
+# Lists of at least BATCH_WORDS words are drawn in numpy batches, up to
+# BATCH_ROUNDS times, before making the rest one at a time
+BATCH_WORDS = 1000
+BATCH_ROUNDS = 3
+
+# Morpheme slots for each POS (nouns also have an optional "prefix")
+POS_SLOTS = {
+    "time": ("postposition",),
+    "loc": ("postposition",),
+    "n": ("suffix",),
+    "v": ("agr", "aspect", "tense", "suffix"),
+    "a": ("suffix",),
+}
+
+# Order the words of a sentence are picked in, and the order they appear in
+DRAW_ORDER = ("n", "a", "v", "time", "loc")
+SENTENCE_ORDER = ("time", "loc", "n", "a", "v")
+
 def load_phon_template(phon_csv):
     """Load phonology from template csv
     Input:
@@ -54,6 +106,8 @@ def load_phon_template(phon_csv):
         initial: whether it can be in initial position (0 or 1)
         medial: whether it can be in medial position (0 or 1)
         final: whether it can be in final position (0 or 1)
+        Optionally, initial_weight, medial_weight, and final_weight give how
+        often the phoneme is used in each position (see load_phon_weights)
         """
         reader = csv.DictReader(source)
         initials = list()
@@ -68,10 +122,637 @@ def load_phon_template(phon_csv):
                 finals.append(row["phoneme"])
     return initials, medials, finals
 
+def load_phon_weights(phon_csv):
+    """Load phoneme frequencies from template csv
+    Input:
+        phon_csv: csv of phonological rules, which may have initial_weight,
+            medial_weight, and final_weight columns (blank means 1)
+    Returns:
+        initial_weights, medial_weights, final_weights: lists of weights in the
+            same order as load_phon_template's lists, or None if the csv has
+            no weight columns
+    """
+    positions = ("initial", "medial", "final")
+    with open(phon_csv) as source:
+        reader = csv.DictReader(source)
+        if not any("{}_weight".format(position) in reader.fieldnames for position in positions):
+            return None
+        weights = ([], [], [])
+        for row in reader:
+            for position, position_weights in zip(positions, weights):
+                if int(row[position]) == 1:
+                    weight = row.get("{}_weight".format(position)) or 1
+                    position_weights.append(float(weight))
+    return weights
+
+class AliasTable:
+    """Walker alias table, for drawing from a weighted list in O(1) per draw
+    Inputs:
+        weights: list of non-negative weights, not all 0
+    """
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("Need at least one positive weight")
+        # Vose's method: split scaled weights into under- and over-full columns
+        scaled = [weight * n / total for weight in weights]
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left is full, up to rounding error
+        for i in small + large:
+            self.prob[i] = 1.0
+        self.prob_array = numpy.array(self.prob)
+        self.alias_array = numpy.array(self.alias)
+
+    def draw(self):
+        """Draw one index"""
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+    def draw_batch(self, rng, size):
+        """Draw size indices at once with a numpy random Generator"""
+        i = rng.integers(0, len(self.prob), size)
+        return numpy.where(rng.random(size) < self.prob_array[i], i, self.alias_array[i])
+
+
+def load_sound_classes(class_csv):
+    """Load phoneme classes for sound changes from a csv
+    Input:
+        class_csv: csv with columns
+            class: name of the class, used in the sound change csv (e.g. V)
+            members: space-separated phonemes in the class
+    Returns:
+        classes: dict of {class: list of phonemes}
+    """
+    classes = dict()
+    with open(class_csv) as source:
+        reader = csv.DictReader(source)
+        for row in reader:
+            classes[row["class"]] = row["members"].split()
+    return classes
+
+class SoundChange:
+    """One rewrite rule, target -> replacement / before _ after
+    Each part is a space-separated sequence of tokens, where a token is a
+    phoneme, a class name, "-" for a morpheme boundary, or (only at the outer
+    edge of before or after) "#" for a word boundary.
+    If the target and replacement are both a single class of the same size,
+    each member becomes the matching member of the replacement class
+    (e.g. P -> B maps p t k to b d g). Otherwise the replacement is spelled
+    out in phonemes, and an empty replacement deletes the target.
+    Rules work on the spelling, so a target p also matches the p of ps.
+    Inputs:
+        target, replacement, before, after: the parts of the rule
+        classes: dict of {class: list of phonemes}
+    """
+    def __init__(self, target, replacement, before, after, classes):
+        self.description = "{} -> {} / {}".format(target, replacement or "0", " ".join(
+            part for part in (before, "_", after) if part))
+        target = target.split()
+        replacement = replacement.split()
+        before = before.split()
+        after = after.split()
+        if not target:
+            raise ValueError("Sound change {} has no target".format(self.description))
+        if "-" in target or "#" in target + replacement:
+            raise ValueError("Sound change {} can't rewrite boundaries".format(self.description))
+        if "#" in before[1:] or "#" in after[:-1]:
+            raise ValueError("# can only be at the edge of the context in {}".format(self.description))
+
+        # Every spelling of the target, and what it becomes
+        if (len(target) == 1 and len(replacement) == 1 and target[0] in classes
+                and replacement[0] in classes):
+            sources = classes[target[0]]
+            results = classes[replacement[0]]
+            if len(sources) != len(results):
+                raise ValueError("Classes {} and {} have different sizes in {}".format(
+                    target[0], replacement[0], self.description))
+            self.mapping = dict(zip(sources, results))
+        else:
+            if any(token in classes for token in replacement):
+                raise ValueError("Replacement can only be a class in a class to class change: {}".format(
+                    self.description))
+            result = "".join(replacement)
+            self.mapping = {source: result for source in self.spellings(target, classes)}
+
+        # Lookbehind has to be fixed width, so the left context becomes one
+        # lookbehind per length of its spellings
+        if before:
+            edge = "^" if before[0] == "#" else ""
+            contexts = self.spellings([token for token in before if token != "#"], classes)
+            lengths = sorted(set(len(context) for context in contexts), reverse=True)
+            left = "(?:{})".format("|".join(
+                "(?<={}{})".format(edge, self.alternation(
+                    [context for context in contexts if len(context) == length]))
+                for length in lengths))
+        else:
+            left = ""
+        if after:
+            edge = "$" if after[-1] == "#" else ""
+            right = "(?={}{})".format("".join(
+                self.alternation(classes.get(token, [token])) for token in after if token != "#"), edge)
+        else:
+            right = ""
+
+        # Multiline, so # also matches at the ends of words in a newline-joined batch
+        self.pattern = re.compile(left + self.alternation(self.mapping) + right, re.MULTILINE)
 
-def lenite(word):
-    """Apply lenition to a word"""
-    pass
+    @staticmethod
+    def spellings(tokens, classes):
+        """Every string a sequence of tokens can spell"""
+        return ["".join(spelling) for spelling in
+                itertools.product(*[classes.get(token, [token]) for token in tokens])]
+
+    @staticmethod
+    def alternation(strings):
+        """Regex matching any of strings, preferring the longest"""
+        return "(?:{})".format("|".join(
+            re.escape(string) for string in sorted(strings, key=len, reverse=True)))
+
+    def replace(self, match):
+        return self.mapping[match.group(0)]
+
+    def apply(self, text):
+        """Apply the change everywhere in text, all at once"""
+        return self.pattern.sub(self.replace, text)
+
+class SoundChanges:
+    """An ordered list of sound changes, applied one after another
+    Results are memoized, so each distinct word is only derived once
+    Inputs:
+        changes: list of SoundChange
+    """
+    def __init__(self, changes):
+        self.changes = changes
+        self.cache = dict()
+
+    @classmethod
+    def from_csv(cls, change_csv, class_csv):
+        """Load sound changes from csvs
+        change_csv should have the following columns:
+            target, replacement, before, after: the parts of the rule (see SoundChange)
+            in_lang: whether the change happens in the language (0 or 1)
+        class_csv has the phoneme classes (see load_sound_classes)
+        Rules are applied in the order of the csv
+        """
+        classes = load_sound_classes(class_csv)
+        changes = list()
+        with open(change_csv) as source:
+            reader = csv.DictReader(source)
+            for row in reader:
+                if int(row["in_lang"]) == 1:
+                    changes.append(SoundChange(row["target"], row["replacement"],
+                        row["before"], row["after"], classes))
+        return cls(changes)
+
+    def apply(self, word):
+        """Apply the sound changes to a word (morphemes can be joined with -)"""
+        if word not in self.cache:
+            result = word
+            for change in self.changes:
+                result = change.apply(result)
+            self.cache[word] = result
+        return self.cache[word]
+
+    def apply_batch(self, words):
+        """Apply the sound changes to a list of words
+        New words are joined with newlines, so each change is one regex pass
+        over the whole batch instead of one per word
+        """
+        new_words = [word for word in dict.fromkeys(words) if word not in self.cache]
+        if new_words:
+            text = "\n".join(new_words)
+            for change in self.changes:
+                text = change.apply(text)
+            self.cache.update(zip(new_words, text.split("\n")))
+        return [self.cache[word] for word in words]
+
+    def derive(self, word):
+        """List the stages of a word's history
+        Returns:
+            list of (change description, form) for each change that altered the word,
+            starting with (None, word)
+        """
+        stages = [(None, word)]
+        for change in self.changes:
+            result = change.apply(stages[-1][1])
+            if result != stages[-1][1]:
+                stages.append((change.description, result))
+        return stages
+
+# Sound changes loaded by lenite, by csv filename
+loaded_sound_changes = dict()
+
+def lenite(word, sound_changes=None):
+    """Apply lenition to a word
+    Inputs:
+        word: the word, with morphemes joined by -
+        sound_changes: SoundChanges to apply, by default the ones in
+            <LANG_NAME>_sound_changes.csv and <LANG_NAME>_sound_classes.csv
+    Returns:
+        the word after the sound changes
+    """
+    if sound_changes is None:
+        change_csv = os.path.join(CONSTRAINTS_DIR, "{}_sound_changes.csv".format(LANG_NAME))
+        if change_csv not in loaded_sound_changes:
+            class_csv = os.path.join(CONSTRAINTS_DIR, "{}_sound_classes.csv".format(LANG_NAME))
+            loaded_sound_changes[change_csv] = SoundChanges.from_csv(change_csv, class_csv)
+        sound_changes = loaded_sound_changes[change_csv]
+    return sound_changes.apply(word)
+
+def lenite_language(defs_words_tags, defs_and_morphemes, sound_changes):
+    """Apply sound changes to every word and morpheme of a language in one batch
+    Inputs:
+        defs_words_tags: list of (definition,word,pos)
+        defs_and_morphemes: list of (meaning,morpheme) tuples
+        sound_changes: SoundChanges to apply
+    Returns:
+        defs_words_tags, defs_and_morphemes with the changed forms
+    """
+    forms = sound_changes.apply_batch([word for definition, word, tag in defs_words_tags] +
+        [morpheme for meaning, morpheme in defs_and_morphemes])
+    word_forms = forms[:len(defs_words_tags)]
+    morpheme_forms = forms[len(defs_words_tags):]
+    return ([(definition, form, tag) for (definition, word, tag), form in zip(defs_words_tags, word_forms)],
+            [(meaning, form) for (meaning, morpheme), form in zip(defs_and_morphemes, morpheme_forms)])
+
+class PhonemeTrie:
+    """Trie over a list of phonemes, to find every phoneme starting at a point in a word"""
+    def __init__(self, phonemes):
+        self.root = dict()
+        self.has_empty = False
+        for phoneme in phonemes:
+            if not phoneme:
+                self.has_empty = True
+                continue
+            node = self.root
+            for char in phoneme:
+                node = node.setdefault(char, dict())
+            # None marks the end of a phoneme
+            node[None] = True
+
+    def ends(self, word, start):
+        """List the end of every phoneme that starts at word[start], shortest first
+        An empty phoneme ends where it starts
+        """
+        ends = [start] if self.has_empty else []
+        node = self.root
+        for end in range(start, len(word)):
+            node = node.get(word[end])
+            if node is None:
+                break
+            if None in node:
+                ends.append(end + 1)
+        return ends
+
+class Phonotactics:
+    """Check and split words against the phonology
+    A word is a sequence of syllables, each an initial, a medial and a final
+    phoneme. Since phonemes like "p" + "s" and "ps" look alike, a word can
+    split into syllables in more than one way, so every split is worked out
+    at once by dynamic programming over (position, syllables so far, slot),
+    in one pass over the word.
+    Inputs:
+        initials, medials, finals: lists of phonemes for each position
+        min_syls, max_syls: range of syllables per word
+    """
+    def __init__(self, initials, medials, finals, min_syls, max_syls):
+        self.tries = (PhonemeTrie(initials), PhonemeTrie(medials), PhonemeTrie(finals))
+        self.min_syls = min_syls
+        self.max_syls = max_syls
+        self.cache = dict()
+
+    def parse(self, word):
+        """Run the dynamic program over a word
+        States are numbered syls * 3 + slot, where slot 0, 1 or 2 is the
+        initial, medial or final phoneme the syllable needs next
+        Returns:
+            ways: list with a dict of {state: number of ways to get there} for each position
+            back: list with a dict of {state: (previous position, previous state)} for each position,
+                keeping the first way found
+        """
+        ways = [dict() for _ in range(len(word) + 1)]
+        back = [dict() for _ in range(len(word) + 1)]
+        ways[0][0] = 1
+        last_state = self.max_syls * 3
+        for start in range(len(word) + 1):
+            # Empty phonemes lead to higher states at the same position, so
+            # going through the states in order handles them too
+            pending = sorted(ways[start])
+            while pending:
+                state = pending.pop(0)
+                if state == last_state:
+                    continue
+                count = ways[start][state]
+                next_state = state + 1
+                for end in self.tries[state % 3].ends(word, start):
+                    if end == start and next_state not in ways[end]:
+                        bisect.insort(pending, next_state)
+                    ways[end][next_state] = ways[end].get(next_state, 0) + count
+                    back[end].setdefault(next_state, (start, state))
+        return ways, back
+
+    def finished_states(self, ways):
+        """States at the end of the word where a whole number of syllables is done"""
+        return [syls * 3 for syls in range(self.min_syls, self.max_syls + 1) if syls * 3 in ways[-1]]
+
+    def segment(self, word):
+        """Split a word into syllables
+        Returns:
+            list of (initial, medial, final) tuples, using the fewest syllables,
+            or None if the phonology doesn't allow the word
+        """
+        if word not in self.cache:
+            ways, back = self.parse(word)
+            finished = self.finished_states(ways)
+            if not finished:
+                self.cache[word] = None
+            else:
+                # Walk the back pointers from the end to get the phonemes
+                phonemes = list()
+                position, state = len(word), finished[0]
+                while position > 0 or state != 0:
+                    start, state = back[position][state]
+                    phonemes.append(word[start:position])
+                    position = start
+                phonemes.reverse()
+                self.cache[word] = [tuple(phonemes[i:i + 3]) for i in range(0, len(phonemes), 3)]
+        return self.cache[word]
+
+    def is_valid(self, word):
+        """Whether the phonology allows the word"""
+        return self.segment(word) is not None
+
+    def count_segmentations(self, word):
+        """Number of ways the word splits into syllables (0 if it isn't allowed)"""
+        ways, back = self.parse(word)
+        return sum(ways[-1][state] for state in self.finished_states(ways))
+
+    def validate_batch(self, words):
+        """Check a list of words
+        Returns:
+            list of (word, syllables) for each word, with syllables None if the word isn't allowed
+        """
+        return [(word, self.segment(word)) for word in words]
+
+def check_lexicon(phon_csv, words, min_syls=1, max_syls=MAX_SYL):
+    """Find the words in a lexicon that the phonology doesn't allow
+    Inputs:
+        phon_csv: csv of phonological constraints
+        words: list of words, e.g. from a language template or an imported word list
+        min_syls, max_syls: range of syllables per word
+    Returns:
+        list of words that don't fit the phonology
+    """
+    initials, medials, finals = load_phon_template(phon_csv)
+    phonotactics = Phonotactics(initials, medials, finals, min_syls, max_syls)
+    return [word for word, syllables in phonotactics.validate_batch(words) if syllables is None]
+
+class LexiconSpace:
+    """Every word the phonology allows, numbered from 0 to size - 1
+    Words are numbered shortest first, and within a length in the same order
+    as itertools.product over the syllables. Different numbers can still spell
+    the same word, since phonemes like "p" + "s" and "ps" look alike.
+    Inputs:
+        initials, medials, finals: lists of phonemes for each position
+        min_syls, max_syls: range of syllables per word
+    """
+    def __init__(self, initials, medials, finals, min_syls, max_syls):
+        self.phonemes = (initials, medials, finals)
+        self.min_syls = min_syls
+        self.max_syls = max_syls
+        self.num_syllables = len(initials) * len(medials) * len(finals)
+        # Number of words with each number of syllables, from min_syls up
+        self.counts = [self.num_syllables ** num_syls for num_syls in range(min_syls, max_syls + 1)]
+        self.size = sum(self.counts)
+
+    def syllable(self, index):
+        """Decode a syllable number into initial + medial + final"""
+        initials, medials, finals = self.phonemes
+        initial, rest = divmod(index, len(medials) * len(finals))
+        medial, final = divmod(rest, len(finals))
+        return initials[initial] + medials[medial] + finals[final]
+
+    def word(self, index):
+        """Decode a word number, by mixed-radix decoding into syllables"""
+        if not 0 <= index < self.size:
+            raise IndexError("word index out of range")
+        num_syls = self.min_syls
+        for count in self.counts:
+            if index < count:
+                break
+            index -= count
+            num_syls += 1
+        syls = list()
+        for syl in range(num_syls):
+            index, syl_index = divmod(index, self.num_syllables)
+            syls.append(self.syllable(syl_index))
+        return "".join(reversed(syls))
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.word(index)
+
+    def sample(self, seed=None):
+        """Yield distinct words in a random order, without replacement
+        The word numbers are shuffled with a FeistelPermutation, so the order
+        takes no memory and there's no rejection loop on the numbers. The words
+        given out are kept in a set to skip homophones, so that set grows with
+        the number of words taken (not with the size of the space)
+        """
+        permutation = FeistelPermutation(self.size, seed)
+        seen = set()
+        for index in range(self.size):
+            word = self.word(permutation.permute(index))
+            # Skip numbers that spell a word we already gave out
+            if word not in seen:
+                seen.add(word)
+                yield word
+
+class FeistelPermutation:
+    """A random permutation of range(size), computed one number at a time
+    A balanced Feistel network permutes numbers of 2 * half_bits bits, and
+    numbers that land outside range(size) are permuted again (cycle walking)
+    Inputs:
+        size: number of items to permute
+        seed: seed for the round keys
+        rounds: number of Feistel rounds
+    """
+    def __init__(self, size, seed=None, rounds=4):
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half_bits) - 1
+        key_rng = random.Random(seed)
+        self.keys = [key_rng.getrandbits(64) for round_num in range(rounds)]
+
+    def round_function(self, value, key):
+        # splitmix64-style mixing
+        value = (value + key + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return (value ^ (value >> 31)) & self.mask
+
+    def encrypt(self, value):
+        left = value >> self.half_bits
+        right = value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self.round_function(right, key)
+        return (left << self.half_bits) | right
+
+    def permute(self, index):
+        """Return where index goes in the permutation"""
+        value = self.encrypt(index)
+        while value >= self.size:
+            value = self.encrypt(value)
+        return value
+
+def drawable_phonemes(phonemes, weights):
+    """Drop the phonemes with weight 0, which can never be drawn
+    Inputs:
+        phonemes: (initials, medials, finals) lists
+        weights: (initial, medial, final) lists of weights from load_phon_weights, or None
+    Returns:
+        (initials, medials, finals) lists of phonemes that can be used
+    """
+    if weights is None:
+        return phonemes
+    return tuple(
+        [phoneme for phoneme, weight in zip(position_phonemes, position_weights) if weight > 0]
+        for position_phonemes, position_weights in zip(phonemes, weights)
+    )
+
+class WordMaker:
+    """Make random words that are all different from each other
+    Inputs:
+        initials, medials, finals: lists of phonemes for each position
+        min_syls, max_syls: range of syllables per word
+        used: set of words that can't be made again (e.g. existing words),
+            new words are added to it
+        weights: (initial, medial, final) lists of phoneme weights from
+            load_phon_weights, or None to pick phonemes uniformly
+    """
+    def __init__(self, initials, medials, finals, min_syls, max_syls, used=None, weights=None):
+        self.phonemes = (initials, medials, finals)
+        self.min_syls = min_syls
+        self.max_syls = max_syls
+        self.used = used if used is not None else set()
+        # To ensure some variety, keep track of the prev initial, medial, and final
+        self.prev = ["", "", ""]
+        self.unused = None
+        self.tables = None if weights is None else [AliasTable(position_weights) for position_weights in weights]
+        self.drawable = drawable_phonemes(self.phonemes, weights)
+
+    def draw_phoneme(self, position):
+        if self.tables is None:
+            return random.choice(self.phonemes[position])
+        return self.phonemes[position][self.tables[position].draw()]
+
+    def choose_phoneme(self, position):
+        """Choose a phoneme for the position, different from the previous one if possible"""
+        phoneme = self.draw_phoneme(position)
+        # Only one phoneme allowed here, so don't spin forever
+        if phoneme == self.prev[position] and any(p != phoneme for p in self.drawable[position]):
+            while phoneme == self.prev[position]:
+                phoneme = self.draw_phoneme(position)
+        self.prev[position] = phoneme
+        return phoneme
+
+    def random_words_batch(self, rng, count):
+        """Make count random words at once, drawing whole syllable arrays with numpy
+        Faster for big lexicons, but doesn't avoid repeating the previous
+        phoneme, and the words might already be used
+        Inputs:
+            rng: numpy random Generator
+            count: number of words
+        Returns:
+            list of words
+        """
+        num_syls = rng.integers(self.min_syls, self.max_syls + 1, count)
+        total_syls = int(num_syls.sum())
+        # syllables[s, position] is the phoneme index of syllable s in that position
+        syllables = numpy.empty((total_syls, 3), dtype=numpy.int64)
+        for position, phonemes in enumerate(self.phonemes):
+            if self.tables is None:
+                syllables[:, position] = rng.integers(0, len(phonemes), total_syls)
+            else:
+                syllables[:, position] = self.tables[position].draw_batch(rng, total_syls)
+        syllable_strings = [
+            self.phonemes[0][initial] + self.phonemes[1][medial] + self.phonemes[2][final]
+            for initial, medial, final in syllables.tolist()
+        ]
+        words = list()
+        start = 0
+        for word_syls in num_syls.tolist():
+            words.append("".join(syllable_strings[start:start + word_syls]))
+            start += word_syls
+        return words
+
+    def random_word(self):
+        """Make a random word, which might already be used"""
+        current_word_parts = list()
+        num_syls = random.randint(self.min_syls,self.max_syls)
+        for syl in range(num_syls):
+            for position in range(3):
+                current_word_parts.append(self.choose_phoneme(position))
+        return "".join(current_word_parts)
+
+    def all_words(self):
+        """Yield every word the phonology allows, shortest first, leaving out phonemes with weight 0"""
+        return iter(LexiconSpace(*self.drawable, min_syls=self.min_syls, max_syls=self.max_syls))
+
+    def new_word(self):
+        """Make a word that hasn't been used yet
+        After MAX_RETRIES random words that were all taken, go through the
+        remaining unused words in order, so this always finishes
+        """
+        for attempt in range(MAX_RETRIES):
+            word = self.random_word()
+            if word not in self.used:
+                break
+        else:
+            # Shared between calls, so each possible word is only checked once
+            if self.unused is None:
+                self.unused = self.all_words()
+            for word in self.unused:
+                if word not in self.used:
+                    break
+            else:
+                raise ValueError("The phonology can't make any more distinct words")
+        self.used.add(word)
+        return word
+
+    def new_words(self, count):
+        """Make count words that haven't been used yet
+        Big lists are drawn in numpy batches (see random_words_batch), skipping
+        used words, and whatever is still missing is made with new_word
+        """
+        words = list()
+        if count >= BATCH_WORDS:
+            # Seeded from random, so seeding random still makes the words repeatable
+            rng = numpy.random.default_rng(random.getrandbits(64))
+            for attempt in range(BATCH_ROUNDS):
+                for word in self.random_words_batch(rng, count - len(words)):
+                    if word not in self.used:
+                        self.used.add(word)
+                        words.append(word)
+                if len(words) == count:
+                    break
+        while len(words) < count:
+            words.append(self.new_word())
+        return words
 
 def create_words(phon_csv,word_csv,max_syls = 4):
     """Make words within constraints
@@ -83,17 +764,8 @@ def create_words(phon_csv,word_csv,max_syls = 4):
         defs_words_tags: list of (definition, word, postag) tuples
     """
     initials, medials, finals = load_phon_template(phon_csv)
-    created_words = list() # list of words
     defs_words_tags = list() # list of (definition,word,tag)
 
-    # To ensure some variety, keep track of the prev word
-    prev_initial = ""
-    prev_medial = ""
-    prev_final = ""
-    cur_initial = ""
-    cur_medial = ""
-    cur_final = ""
-
     defs_and_tags = list()
 
     # Get the definitions and tags from the word list
@@ -102,31 +774,49 @@ def create_words(phon_csv,word_csv,max_syls = 4):
         for row in reader:
             defs_and_tags.append((row["Word"],row["POS"]))
 
-    # Create the words
-    for definition,tag in defs_and_tags:
-        word = None
-        current_word_parts = list()
+    # Create the words, avoiding homophones
+    weights = load_phon_weights(phon_csv)
+    word_maker = WordMaker(initials, medials, finals, 1, max_syls, weights=weights)
+    words = word_maker.new_words(len(defs_and_tags))
+    for (definition,tag), word in zip(defs_and_tags, words):
+        defs_words_tags.append((definition,word,tag))
+    return defs_words_tags
+
+def create_words_exhaustive(phon_csv,word_csv,max_syls = 4,seed=None):
+    """Make words within constraints, by sampling the space of possible words
+    without replacement, so there are no homophones and no retries
+    Inputs:
+        phon_csv: csv of phonological constraints
+        word_csv: csv of words and their parts of speech
+        max_syls: max syls per word
+        seed: seed for the random order of words
+    Returns:
+        defs_words_tags: list of (definition, word, postag) tuples
+    """
+    # Phonemes with weight 0 are never used, so they aren't part of the space
+    initials, medials, finals = drawable_phonemes(load_phon_template(phon_csv), load_phon_weights(phon_csv))
+    space = LexiconSpace(initials, medials, finals, 1, max_syls)
 
-        # Loop to avoid homophones
-        while word is None or word in created_words:
-            num_syls = random.randint(1,max_syls)
-            for syl in range(num_syls):
-                while cur_initial == prev_initial:
-                    cur_initial = random.choice(initials)
-                prev_initial = cur_initial
-                current_word_parts.append(cur_initial)
-
-                while cur_medial == prev_medial:
-                    cur_medial = random.choice(medials)
-                prev_medial = cur_medial
-                current_word_parts.append(cur_medial)
-
-                while cur_final == prev_final:
-                    cur_final = random.choice(finals)
-                prev_final = cur_final
-                current_word_parts.append(cur_final)
-            word = "".join(current_word_parts)
-        created_words.append(word)
+    defs_and_tags = list()
+    with open(word_csv) as source:
+        reader = csv.DictReader(source)
+        for row in reader:
+            defs_and_tags.append((row["Word"],row["POS"]))
+
+    # space.size counts syllable sequences, which is an upper bound on the
+    # distinct words, so this only catches lists that can never fit
+    if len(defs_and_tags) > space.size:
+        raise ValueError("The word list has {} words, but the phonology allows at most {} words of up to {} syllables".format(
+            len(defs_and_tags), space.size, max_syls))
+
+    defs_words_tags = list()
+    words = space.sample(seed)
+    for definition,tag in defs_and_tags:
+        word = next(words, None)
+        if word is None:
+            # Only possible if many numbers spell the same words
+            raise ValueError("The phonology only allows {} distinct words of up to {} syllables".format(
+                len(defs_words_tags), max_syls))
         defs_words_tags.append((definition,word,tag))
     return defs_words_tags
 
@@ -138,7 +828,6 @@ def create_morphemes(defs_words_tags, phon_csv,morph_csv,max_syls=1):
         morph_csv: csv of morphemes that exist in the language
         max_syls: max syl length of morpheme
     """
-    morphemes = list() # list of morphemes
     defs_and_morphemes = list() # list of (meaning,morpheme) tuples
     initials, medials, finals = load_phon_template(phon_csv)
 
@@ -150,41 +839,14 @@ def create_morphemes(defs_words_tags, phon_csv,morph_csv,max_syls=1):
             if int(row['in_lang']) == 1:
                 morph_meanings.append(row['morpheme'])
 
-    # Get list of existing words to avoid homophones
-    existing_words = [word for definition, word,tag in defs_words_tags]
-
-    # To ensure some variety, keep track of the prev word
-    prev_initial = ""
-    prev_medial = ""
-    prev_final = ""
-    cur_initial = ""
-    cur_medial = ""
-    cur_final = ""
-
-    for morph_meaning in morph_meanings:
-        morpheme = None
-        current_morpheme_parts = list()
-
-        # Loop to avoid homophones
-        while morpheme is None or morpheme in existing_words or morpheme in morphemes:
-            num_syls = random.randint(0,max_syls)
-            for syl in range(num_syls):
-                while cur_initial == prev_initial:
-                    cur_initial = random.choice(initials)
-                prev_initial = cur_initial
-                current_morpheme_parts.append(cur_initial)
-
-                while cur_medial == prev_medial:
-                    cur_medial = random.choice(medials)
-                prev_medial = cur_medial
-                current_morpheme_parts.append(cur_medial)
-
-                while cur_final == prev_final:
-                    cur_final = random.choice(finals)
-                prev_final = cur_final
-                current_morpheme_parts.append(cur_final)
-            morpheme = "".join(current_morpheme_parts)
-        morphemes.append(morpheme)
+    # Get set of existing words to avoid homophones
+    existing_words = set(word for definition, word,tag in defs_words_tags)
+
+    # Create the morphemes, avoiding homophones with words and other morphemes
+    weights = load_phon_weights(phon_csv)
+    morpheme_maker = WordMaker(initials, medials, finals, 0, max_syls, used=existing_words, weights=weights)
+    morphemes = morpheme_maker.new_words(len(morph_meanings))
+    for morph_meaning, morpheme in zip(morph_meanings, morphemes):
         defs_and_morphemes.append((morph_meaning,morpheme))
     return defs_and_morphemes
 
@@ -197,68 +859,143 @@ def write_language_template(defs_words_tags, defs_and_morphemes,dest_fname):
         for definition, morpheme in defs_and_morphemes:
             dest.write("{},{}\n".format(definition,morpheme))
 
-def apply_morphology(word,word_def,pos,defs_and_morphemes):
-    """Apply morphology to word
+class MorphologyTable:
+    """Morphemes bucketed by POS and slot, compiled once from a language template
+    Inputs:
+        defs_and_morphemes: list of (meaning,morpheme) tuples
+    """
+    def __init__(self, defs_and_morphemes):
+        prepositions = [
+            (definition, morpheme) for definition, morpheme in defs_and_morphemes
+            if definition.startswith("prep_")
+        ]
+        verb_morphemes = [
+            (definition, morpheme) for definition, morpheme in defs_and_morphemes
+            if definition.startswith("v_")
+        ]
+        agr = list()
+        tense = list()
+        aspect = list()
+        other_v_suffix = list()
+        for definition, morpheme in verb_morphemes:
+            if "agr" in definition: agr.append((definition, morpheme))
+            elif "aspect" in definition: aspect.append((definition, morpheme))
+            elif "tense" in definition: tense.append((definition, morpheme))
+            else: other_v_suffix.append((definition, morpheme))
+
+        # {(pos, slot): tuple of (meaning,morpheme)}
+        self.slots = {
+            ("time", "postposition"): tuple(
+                (definition, morpheme) for definition, morpheme in prepositions
+                if "time" in definition),
+            ("loc", "postposition"): tuple(
+                (definition, morpheme) for definition, morpheme in prepositions
+                if "loc" in definition),
+            ("n", "prefix"): tuple(
+                (definition, morpheme) for definition, morpheme in prepositions
+                if "loc" not in definition and "time" not in definition),
+            ("n", "suffix"): tuple(
+                (definition, morpheme) for definition, morpheme in defs_and_morphemes
+                if definition.startswith("n_")),
+            ("v", "agr"): tuple(agr),
+            ("v", "aspect"): tuple(aspect),
+            ("v", "tense"): tuple(tense),
+            ("v", "suffix"): tuple(other_v_suffix),
+            ("a", "suffix"): tuple(
+                (definition, morpheme) for definition, morpheme in defs_and_morphemes
+                if definition.startswith("a_")),
+        }
+
+    @classmethod
+    def from_slots(cls, slots):
+        """Rebuild a table from the slots of a compiled one, without re-bucketing"""
+        table = cls.__new__(cls)
+        table.slots = slots
+        return table
+
+    def choose(self, pos, slot):
+        """Pick a random (meaning,morpheme) for the slot"""
+        return random.choice(self.slots[(pos, slot)])
+
+    def draw(self, pos):
+        """Pick random morphemes for every slot of the POS
+        Returns:
+            morphemes: dict of {slot: (meaning,morpheme)}, the noun prefix may be None
+        """
+        if pos == "n":
+            # Only add a preposition 20% of the time
+            # (never, if the language has no prepositions to use as prefixes)
+            preposition_likelihood = random.random()
+            if preposition_likelihood > .8 and self.slots[("n", "prefix")]:
+                prefix = self.choose("n", "prefix")
+            else:
+                prefix = None
+            return {"prefix": prefix, "suffix": self.choose("n", "suffix")}
+        return {slot: self.choose(pos, slot) for slot in POS_SLOTS.get(pos, ())}
+
+    def draw_batch(self, pos, rng, size):
+        """Pick morpheme indices for every slot of the POS, for size words at once
+        Inputs:
+            rng: numpy random Generator
+        Returns:
+            draws: dict of {slot: list of indices into the slot's morphemes}, -1 for no morpheme
+        """
+        draws = {
+            slot: rng.integers(0, len(self.slots[(pos, slot)]), size).tolist()
+            for slot in POS_SLOTS.get(pos, ())
+        }
+        if pos == "n" and not self.slots[("n", "prefix")]:
+            # No prepositions to use as prefixes
+            draws["prefix"] = [-1] * size
+        elif pos == "n":
+            # Only add a preposition 20% of the time
+            with_prefix = rng.random(size) > .8
+            prefixes = rng.integers(0, len(self.slots[("n", "prefix")]), size)
+            draws["prefix"] = numpy.where(with_prefix, prefixes, -1).tolist()
+        return draws
+
+    def pick(self, pos, draws, i):
+        """Turn the i-th indices from draw_batch into the same dict draw returns"""
+        morphemes = dict()
+        for slot, indices in draws.items():
+            index = indices[i]
+            morphemes[slot] = self.slots[(pos, slot)][index] if index >= 0 else None
+        return morphemes
+
+def conjugate(word,word_def,pos,morphemes):
+    """Attach the chosen morphemes to a word
     Inputs:
         word: the word itself (in the target language)
         word_def: word definition in English
         pos: postag of the word
-        defs_and_morphemes: list of (meaning,morpheme) tuples
+        morphemes: dict of {slot: (meaning,morpheme)}, from MorphologyTable.draw
     Returns:
         word_conj: conjugated form of the word
         gloss: meanings of the word and its morphemes
     """
-    # TODO: move defs_and_morphemes out of here to save time
-
     # Conjugated form of the word, with morphology applied
     word_conj = ""
 
     # English definition of the word and its morphemes
     gloss = []
 
-    """Based on POS, get the relevant morphemes,
-        add them to the word, and get the gloss too"""
-
     if pos == "time":
-        time_postpositions = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("prep_") and "time" in definition
-        ]
-        time_def, time_morph = random.choice(time_postpositions)
+        time_def, time_morph = morphemes["postposition"]
         gloss.append(word_def)
         # Split at _ and take the last item to just get the prep meaning
         gloss.append(time_def.split("_")[-1])
         word_conj = "{}-{}".format(word,time_morph)
 
     elif pos == "loc":
-        loc_postpositions = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("prep_") and "loc" in definition
-        ]
-        loc_def, loc_morph = random.choice(loc_postpositions)
+        loc_def, loc_morph = morphemes["postposition"]
         gloss.append(word_def)
         # Split at _ and take the last item to just get the prep meaning
         gloss.append(loc_def.split("_")[-1])
         word_conj = "{}-{}".format(word,loc_morph)
 
     elif pos == "n":
-        n_prefixes = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("prep_") and "loc" not in definition and "time" not in definition
-        ]
-        n_suffixes = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("n_")
-        ]
-
-        # Only add a preposition 20% of the time
-        preposition_likelihood = random.random()
-        if preposition_likelihood > .8:
-            prefix_def, noun_prefix = random.choice(n_prefixes)
-        else:
-            prefix_def, noun_prefix = (None, None)
-
-        suffix_def, noun_suffix = random.choice(n_suffixes)
+        prefix_def, noun_prefix = morphemes["prefix"] or (None, None)
+        suffix_def, noun_suffix = morphemes["suffix"]
         if prefix_def is not None:
             gloss.append(prefix_def)
             gloss.append(word_def)
@@ -270,35 +1007,17 @@ def apply_morphology(word,word_def,pos,defs_and_morphemes):
             word_conj = "{}-{}".format(word,noun_suffix)
 
     elif pos == "v":
-        verb_morphemes = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("v_")
-        ]
-        agr = list()
-        tense = list()
-        aspect = list()
-        other_v_suffix = list()
-        for definition, morpheme in verb_morphemes:
-            if "agr" in definition: agr.append((definition, morpheme))
-            elif "aspect" in definition: aspect.append((definition, morpheme))
-            elif "tense" in definition: tense.append((definition, morpheme))
-            else: other_v_suffix.append((definition, morpheme))
-
-        agr_def, v_agr = random.choice(agr)
-        aspect_def, v_aspect = random.choice(aspect)
-        tense_def, v_tense = random.choice(tense)
-        suffix_def, v_suffix = random.choice(other_v_suffix)
+        agr_def, v_agr = morphemes["agr"]
+        aspect_def, v_aspect = morphemes["aspect"]
+        tense_def, v_tense = morphemes["tense"]
+        suffix_def, v_suffix = morphemes["suffix"]
 
         word_conj = "{}-{}-{}-{}".format(v_agr,v_aspect,word,v_tense,v_suffix)
         gloss.extend([agr_def.replace("agr_",""), aspect_def.replace("aspect_",""),
             word_def, tense_def.replace("tense_",""), suffix_def.split("_")[-1]])
 
     elif pos == "a":
-        adj_morphemes = [
-            (definition, morpheme) for definition, morpheme in defs_and_morphemes
-            if definition.startswith("a_")
-        ]
-        suffix_def, adj_suffix = random.choice(adj_morphemes)
+        suffix_def, adj_suffix = morphemes["suffix"]
         word_conj = "{}-{}".format(word,adj_suffix)
         gloss.append(word_def)
         gloss.append(suffix_def)
@@ -309,22 +1028,50 @@ def apply_morphology(word,word_def,pos,defs_and_morphemes):
 
     return word_conj,gloss
 
-def create_text(lang_template,num_sents=10):
-    """Create a text based on the language template
+def apply_morphology(word,word_def,pos,morphology):
+    """Apply morphology to word
     Inputs:
-        lang_template: template csv
-        num_sents: number of sentences
+        word: the word itself (in the target language)
+        word_def: word definition in English
+        pos: postag of the word
+        morphology: MorphologyTable, or a list of (meaning,morpheme) tuples
     Returns:
-        text
-        gloss
+        word_conj: conjugated form of the word
+        gloss: meanings of the word and its morphemes
     """
-    text = list() # The created text
-    gloss = list()
+    # Compile a list once here, but callers should pass a MorphologyTable to save time
+    if not isinstance(morphology, MorphologyTable):
+        morphology = MorphologyTable(morphology)
 
+    """Based on POS, get the relevant morphemes,
+        add them to the word, and get the gloss too"""
+    return conjugate(word,word_def,pos,morphology.draw(pos))
+
+def inflect_entry(entry,morphemes):
+    """Conjugate a template word and gloss it, removing tags such as w_ and a_
+    Inputs:
+        entry: (meaning,word,tag) tuple from the language template
+        morphemes: dict of {slot: (meaning,morpheme)}, from MorphologyTable.draw
+    Returns:
+        word_conj: conjugated form of the word
+        gloss_string: gloss of the word and its morphemes, joined with -
+    """
+    meaning, word, tag = entry
+    tag_prefix = "{}_".format(tag)
+    word_conj, gloss = conjugate(word.replace(tag_prefix,""),meaning.replace("w_",""),tag,morphemes)
+    return word_conj, "-".join(gloss).replace(tag_prefix,"")
+
+def load_language_template(lang_template):
+    """Load the words and morphemes from a language template csv
+    Inputs:
+        lang_template: template csv
+    Returns:
+        words: list of (meaning,word,tag) tuples
+        defs_and_morphemes: list of (meaning,morpheme) tuples
+    """
     words = list()
     defs_and_morphemes = list()
 
-    # Get the words and morphemes
     with open(lang_template) as source:
         reader = csv.DictReader(source)
         for row in reader:
@@ -332,122 +1079,343 @@ def create_text(lang_template,num_sents=10):
                 words.append((row["Meaning"],row["Word"],row["Tag"]))
             else:
                 defs_and_morphemes.append((row["Meaning"],row["Word"]))
+    return words, defs_and_morphemes
+
+def hash_sources(fnames,*settings):
+    """Content hash of the source csvs (and any settings), to tell if a compiled language is stale"""
+    digest = hashlib.sha256()
+    for fname in fnames:
+        with open(fname,'rb') as source:
+            digest.update(hashlib.sha256(source.read()).digest())
+    digest.update(repr(settings).encode("utf-8"))
+    return digest.hexdigest()
+
+def compile_language(defs_words_tags,defs_and_morphemes,phon_csv,source_hash):
+    """Bundle everything text generation needs into one picklable dict
+    Inputs:
+        defs_words_tags: list of (definition,word,pos) that we created
+        defs_and_morphemes: list of (meaning,morpheme) tuples
+        phon_csv: csv of phonological constraints
+        source_hash: hash_sources of the csvs the language was made from
+    Returns:
+        language: dict with the phoneme tables, lexicon, and bucketed morphology
+    """
+    words = [("w_{}".format(definition),word,tag) for definition, word, tag in defs_words_tags]
+    return {
+        "version": LANGUAGE_VERSION,
+        "source_hash": source_hash,
+        "phonemes": load_phon_template(phon_csv),
+        "weights": load_phon_weights(phon_csv),
+        "defs_words_tags": defs_words_tags,
+        "defs_and_morphemes": defs_and_morphemes,
+        "words_by_pos": group_words_by_pos(words),
+        # Only plain data is pickled, so the file loads from any module
+        "morphology_slots": MorphologyTable(defs_and_morphemes).slots,
+    }
+
+def save_language(language,dest_fname):
+    """Write a compiled language to dest_fname"""
+    with open(dest_fname,'wb') as dest:
+        pickle.dump(language,dest,protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_compiled_language(language_fname,source_hash=None):
+    """Load a compiled language
+    Inputs:
+        language_fname: file written by save_language
+        source_hash: if given, the language must have been made from these sources
+    Returns:
+        language dict, or None if the file is missing, from an older version, or stale
+    """
+    try:
+        with open(language_fname,'rb') as source:
+            language = pickle.load(source)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if language.get("version") != LANGUAGE_VERSION:
+        return None
+    if source_hash is not None and language["source_hash"] != source_hash:
+        return None
+    return language
+
+def load_language(lang_fname):
+    """Load what text generation needs from a compiled language or a template csv
+    Inputs:
+        lang_fname: compiled language (LANGUAGE_EXT) or template csv
+    Returns:
+        (dict of {tag: tuple of words}, MorphologyTable)
+    """
+    if lang_fname.endswith(LANGUAGE_EXT):
+        language = load_compiled_language(lang_fname)
+        if language is None:
+            raise ValueError("{} isn't a compiled language of this version".format(lang_fname))
+        return language["words_by_pos"], MorphologyTable.from_slots(language["morphology_slots"])
+    words, defs_and_morphemes = load_language_template(lang_fname)
+    return group_words_by_pos(words), MorphologyTable(defs_and_morphemes)
+
+def group_words_by_pos(words):
+    """Group (meaning,word,tag) tuples into a dict of {tag: tuple of words}"""
+    words_by_pos = dict()
+    for word in words:
+        words_by_pos.setdefault(word[2], list()).append(word)
+    return {pos: tuple(pos_words) for pos, pos_words in words_by_pos.items()}
 
-    # Get the words for each part of speech
-    # TODO: do this in less code
-
-    nouns = [
-        word for word in words if word[2] == "n"
-    ]
-    verbs = [
-        word for word in words if word[2] == "v"
-    ]
-    adjectives = [
-        word for word in words if word[2] == "a"
-    ]
-    determiners = [
-        word for word in words if word[2] == "det"
-    ]
-    conjunctions = [
-        word for word in words if word[2] == "conj"
-    ]
-    times = [
-        word for word in words if word[2] == "time"
-    ]
-    locations = [
-        word for word in words if word[2] == "loc"
-    ]
+def create_text(lang_template,num_sents=10):
+    """Create a text based on the language template
+    Inputs:
+        lang_template: template csv or compiled language
+        num_sents: number of sentences
+    Returns:
+        text
+        gloss
+    """
+    text = list() # The created text
+    gloss = list()
 
+    # Get the words for each part of speech, and the morphemes bucketed by slot
+    words_by_pos, morphology = load_language(lang_template)
 
     # Create the sentences
-    # TODO: do this in less code
-
     for sent_count in range(num_sents):
-        current_sent = list()
-        obj = random.choice(nouns)
-        obj_def = obj[0].replace("w_","")
-        obj_word = obj[1].replace("n_","")
-        obj_tag = obj[2]
-
-        adj = random.choice(adjectives)
-        adj_def = adj[0].replace("w_","")
-        adj_word = adj[1].replace("a_","")
-        adj_tag = adj[2]
-
-        verb = random.choice(verbs)
-        verb_def = verb[0].replace("w_","")
-        verb_word = verb[1].replace("v_","")
-        verb_tag = verb[2]
-
-        time = random.choice(times)
-        time_def = time[0].replace("w_","")
-        time_word = time[1].replace("time_","")
-        time_tag = time[2]
-
-        loc = random.choice(locations)
-        loc_def = loc[0].replace("w_","")
-        loc_word = loc[1].replace("loc_","")
-        loc_tag = loc[2]
-
-        # Conjugate, get glosses, and remove tags such as w_ and a_
-        # TODO: less code, better code
-        obj_conj,obj_gloss = apply_morphology(obj_word,obj_def,obj_tag,defs_and_morphemes)
-        obj_gloss_string = "-".join([item for item in obj_gloss]).replace("n_","")
-
-        adj_conj,adj_gloss = apply_morphology(adj_word,adj_def,adj_tag,defs_and_morphemes)
-        adj_gloss_string = "-".join([item for item in adj_gloss]).replace("a_","")
-
-        verb_conj,verb_gloss = apply_morphology(verb_word,verb_def,verb_tag,defs_and_morphemes)
-        verb_gloss_string = "-".join([item for item in verb_gloss]).replace("v_","")
-
-        time_conj,time_gloss = apply_morphology(time_word,time_def,time_tag,defs_and_morphemes)
-        time_gloss_string = "-".join([item for item in time_gloss]).replace("time_","")
-
-        loc_conj,loc_gloss = apply_morphology(loc_word,loc_def,loc_tag,defs_and_morphemes)
-        loc_gloss_string = "-".join([item for item in loc_gloss]).replace("loc_","")
-
-        current_sent = [time_conj, loc_conj, obj_conj, adj_conj, verb_conj]
-        current_gloss = [
-                    time_gloss_string, loc_gloss_string,
-                    obj_gloss_string, adj_gloss_string, verb_gloss_string
-        ]
-        text.extend(current_sent)
-        gloss.extend(current_gloss)
+        # Pick all the words first, then their morphology
+        entries = {pos: random.choice(words_by_pos[pos]) for pos in DRAW_ORDER}
+        inflected = {pos: inflect_entry(entries[pos],morphology.draw(pos)) for pos in DRAW_ORDER}
+        for pos in SENTENCE_ORDER:
+            text.append(inflected[pos][0])
+            gloss.append(inflected[pos][1])
         punct = random.choice(PUNCTUATION)
         text.append(punct)
         gloss.append(punct)
 
     return " ".join(text), " ".join(gloss)
 
+def generate_sentences(lang_template,num_sents,seed=None,batch_size=10000):
+    """Generate sentences one at a time, for building large corpora
+    Random draws are made with numpy in batches of batch_size sentences,
+    so memory use doesn't grow with num_sents
+    Inputs:
+        lang_template: template csv or compiled language
+        num_sents: number of sentences
+        seed: seed for numpy's random Generator, or a numpy SeedSequence
+        batch_size: number of sentences drawn at once
+    Yields:
+        (sentence, gloss) string pairs, each ending with its punctuation
+    """
+    return sentences_from_language(load_language(lang_template),num_sents,seed,batch_size)
+
+def sentences_from_language(language,num_sents,seed=None,batch_size=10000):
+    """Same as generate_sentences, for a language that is already loaded
+    Inputs:
+        language: (dict of {tag: tuple of words}, MorphologyTable)
+    """
+    words_by_pos, morphology = language
+    rng = numpy.random.default_rng(seed)
+
+    remaining = num_sents
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        word_draws = {pos: rng.integers(0, len(words_by_pos[pos]), size).tolist() for pos in DRAW_ORDER}
+        morph_draws = {pos: morphology.draw_batch(pos, rng, size) for pos in DRAW_ORDER}
+        punct_draws = rng.integers(0, len(PUNCTUATION), size).tolist()
+        for i in range(size):
+            sentence = list()
+            sentence_gloss = list()
+            for pos in SENTENCE_ORDER:
+                entry = words_by_pos[pos][word_draws[pos][i]]
+                word_conj, gloss_string = inflect_entry(entry,morphology.pick(pos, morph_draws[pos], i))
+                sentence.append(word_conj)
+                sentence_gloss.append(gloss_string)
+            punct = PUNCTUATION[punct_draws[i]]
+            sentence.append(punct)
+            sentence_gloss.append(punct)
+            yield " ".join(sentence), " ".join(sentence_gloss)
+        remaining -= size
+
+def write_corpus(sentences,dest_dir,shard_size=100000,fmt="jsonl",prefix="corpus"):
+    """Write (sentence, gloss) pairs to numbered shard files, one pair per line
+    Inputs:
+        sentences: iterable of (sentence, gloss) pairs, e.g. from generate_sentences
+        dest_dir: directory for the shards
+        shard_size: max sentences per shard
+        fmt: "jsonl" ({"text": ..., "gloss": ...} per line) or "tsv" (text<TAB>gloss)
+        prefix: start of the shard filenames
+    Returns:
+        shard_fnames: list of the shard files written
+    """
+    if fmt not in ("jsonl", "tsv"):
+        raise ValueError("Unknown corpus format: {}".format(fmt))
+    os.makedirs(dest_dir, exist_ok=True)
+    shard_fnames = list()
+    dest = None
+    count = 0
+    try:
+        for sentence, gloss in sentences:
+            if count % shard_size == 0:
+                if dest is not None:
+                    dest.close()
+                shard_fname = os.path.join(dest_dir,"{}-{:05d}.{}".format(prefix,len(shard_fnames),fmt))
+                shard_fnames.append(shard_fname)
+                dest = open(shard_fname,'w',encoding='utf-8')
+            if fmt == "jsonl":
+                dest.write(json.dumps({"text": sentence, "gloss": gloss}, ensure_ascii=False))
+            else:
+                dest.write("{}\t{}".format(sentence, gloss))
+            dest.write("\n")
+            count += 1
+    finally:
+        if dest is not None:
+            dest.close()
+    return shard_fnames
+
+# Language loaded once in each corpus worker process, by init_corpus_worker
+worker_language = None
+
+# Shard files written by write_corpus_parallel
+CORPUS_PART = re.compile(r"corpus-part\d{3}-\d{5}\.(jsonl|tsv)$")
+
+def init_corpus_worker(lang_template):
+    """Load the language once per worker process
+    A compiled language loads fastest, since nothing has to be parsed
+    """
+    global worker_language
+    worker_language = load_language(lang_template)
+
+def write_corpus_part(task):
+    """Generate and write one worker's share of a corpus
+    Inputs:
+        task: (part number, number of sentences, numpy SeedSequence,
+            dest_dir, shard_size, fmt)
+    Returns:
+        shard_fnames: list of the shard files written
+    """
+    part, num_sents, seed, dest_dir, shard_size, fmt = task
+    sentences = sentences_from_language(worker_language,num_sents,seed)
+    return write_corpus(sentences,dest_dir,shard_size,fmt,prefix="corpus-part{:03d}".format(part))
+
+def write_corpus_parallel(lang_template,num_sents,dest_dir,workers=1,seed=None,
+        shard_size=100000,fmt="jsonl"):
+    """Generate a corpus with a pool of worker processes
+    The sentences are split evenly between the workers, and each worker gets
+    its own random stream spawned from seed, so the shards are byte-identical
+    for the same seed and number of workers
+    Shards left in dest_dir by an earlier run are removed first, so a run with
+    fewer workers or bigger shards doesn't mix old sentences into the corpus
+    Inputs:
+        lang_template: template csv or compiled language
+        num_sents: total number of sentences
+        dest_dir: directory for the shards
+        workers: number of processes
+        seed: integer seed
+        shard_size: max sentences per shard
+        fmt: "jsonl" or "tsv"
+    Returns:
+        shard_fnames: list of the shard files written, in order
+    """
+    if os.path.isdir(dest_dir):
+        for fname in os.listdir(dest_dir):
+            if CORPUS_PART.match(fname):
+                os.remove(os.path.join(dest_dir, fname))
+    seeds = numpy.random.SeedSequence(seed).spawn(workers)
+    tasks = [
+        (part, num_sents // workers + (1 if part < num_sents % workers else 0),
+            seeds[part], dest_dir, shard_size, fmt)
+        for part in range(workers)
+    ]
+    if workers > 1:
+        with multiprocessing.Pool(workers, init_corpus_worker, (lang_template,)) as pool:
+            part_fnames = pool.map(write_corpus_part, tasks)
+    else:
+        init_corpus_worker(lang_template)
+        part_fnames = [write_corpus_part(task) for task in tasks]
+    return [fname for fnames in part_fnames for fname in fnames]
+
 
 if __name__ == "__main__":
 
-    print("Creating language from {} template".format(LANG_NAME))
+    parser = argparse.ArgumentParser(description="Create a language and sample text")
+    parser.add_argument("--corpus", type=int, default=0,
+        help="number of sentences to write to a generated corpus")
+    parser.add_argument("--corpus-dir", default="corpus")
+    parser.add_argument("--format", choices=["jsonl", "tsv"], default="jsonl")
+    parser.add_argument("--shard-size", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--exhaustive", action="store_true",
+        help="sample words from the whole space of possible words, without retries")
+    parser.add_argument("--lenite", action="store_true",
+        help="apply the sound changes in <LANG_NAME>_sound_changes.csv to the new language")
+    parser.add_argument("--check", metavar="CSV",
+        help="check the Word column of a csv against the phonology, and exit")
+    parser.add_argument("--rebuild", action="store_true",
+        help="create a new language even if the compiled one is up to date")
+    parser.add_argument("--workers", type=int, default=1,
+        help="number of processes used to write the corpus")
+    args = parser.parse_args()
+
     phon_csv = "{}_phonology.csv".format(LANG_NAME)
     morph_csv = "{}_morphology.csv".format(LANG_NAME)
     phon_filename = os.path.join(CONSTRAINTS_DIR,phon_csv)
     morph_filename = os.path.join(CONSTRAINTS_DIR,morph_csv)
-    defs_words_tags = create_words(phon_filename,WORD_LIST_FNAME,max_syls=MAX_SYL)
-    for definition, word,tag in defs_words_tags:
-        print("{}: {} ({})".format(definition, word,tag))
-    print()
+    template_fname = os.path.join(CONSTRAINTS_DIR,"{}_template.csv".format(LANG_NAME))
+    language_fname = os.path.join(CONSTRAINTS_DIR,"{}{}".format(LANG_NAME,LANGUAGE_EXT))
+
+    if args.check:
+        # Check a word list against the phonology instead of creating a language
+        with open(args.check) as source:
+            words = [row["Word"] for row in csv.DictReader(source)]
+        invalid = check_lexicon(phon_filename,words,min_syls=0,max_syls=MAX_SYL)
+        print("{} of {} words don't fit the {} phonology".format(len(invalid), len(words), LANG_NAME))
+        for word in invalid:
+            print(word)
+        raise SystemExit(1 if invalid else 0)
+
+    change_filename = os.path.join(CONSTRAINTS_DIR,"{}_sound_changes.csv".format(LANG_NAME))
+    class_filename = os.path.join(CONSTRAINTS_DIR,"{}_sound_classes.csv".format(LANG_NAME))
+
+    # Reuse the compiled language unless the csvs or settings have changed
+    source_fnames = [phon_filename,morph_filename,WORD_LIST_FNAME]
+    if args.lenite:
+        source_fnames.extend([change_filename,class_filename])
+    # The seed only decides the words in --exhaustive mode
+    seed = args.seed if args.exhaustive else None
+    source_hash = hash_sources(source_fnames,MAX_SYL,args.exhaustive,args.lenite,seed)
+    language = None if args.rebuild else load_compiled_language(language_fname,source_hash)
+
+    if language is not None:
+        print("Using compiled {} language from {}".format(LANG_NAME, language_fname))
+        print()
+    else:
+        print("Creating language from {} template".format(LANG_NAME))
+        if args.exhaustive:
+            defs_words_tags = create_words_exhaustive(phon_filename,WORD_LIST_FNAME,max_syls=MAX_SYL,seed=args.seed)
+        else:
+            defs_words_tags = create_words(phon_filename,WORD_LIST_FNAME,max_syls=MAX_SYL)
+        for definition, word,tag in defs_words_tags:
+            print("{}: {} ({})".format(definition, word,tag))
+        print()
 
-    print("Creating morphemes:")
-    defs_and_morphemes = create_morphemes(defs_words_tags, phon_filename,morph_filename,max_syls=1)
-    for definition, morpheme in defs_and_morphemes:
-        print("{}: {}".format(definition, morpheme))
-    print()
+        print("Creating morphemes:")
+        defs_and_morphemes = create_morphemes(defs_words_tags, phon_filename,morph_filename,max_syls=1)
+        for definition, morpheme in defs_and_morphemes:
+            print("{}: {}".format(definition, morpheme))
+        print()
 
+        if args.lenite:
+            print("Applying sound changes:")
+            sound_changes = SoundChanges.from_csv(change_filename,class_filename)
+            defs_words_tags, defs_and_morphemes = lenite_language(defs_words_tags,defs_and_morphemes,sound_changes)
+            for definition, word,tag in defs_words_tags:
+                print("{}: {} ({})".format(definition, word,tag))
+            print()
 
-    print("Writing language template:")
-    template_fname = os.path.join(CONSTRAINTS_DIR,"{}_template.csv".format(LANG_NAME))
-    write_language_template(defs_words_tags,defs_and_morphemes,template_fname)
+        print("Writing language template:")
+        write_language_template(defs_words_tags,defs_and_morphemes,template_fname)
+        language = compile_language(defs_words_tags,defs_and_morphemes,phon_filename,source_hash)
+        save_language(language,language_fname)
 
 
     #template_fname = os.path.join(CONSTRAINTS_DIR,"{}_template_saved.csv".format(LANG_NAME))
 
     print("Creating sample text:")
-    text, trans = create_text(template_fname)
+    text, trans = create_text(language_fname)
     text_sents = text.split(".")
     trans_sents = trans.split(".")
     for i in range(len(text_sents)):
@@ -456,3 +1424,9 @@ if __name__ == "__main__":
         print(trans_sents[i])
         print()
     print()
+
+    if args.corpus:
+        print("Writing {} sentences to {}".format(args.corpus, args.corpus_dir))
+        shard_fnames = write_corpus_parallel(language_fname,args.corpus,args.corpus_dir,
+            args.workers,args.seed,args.shard_size,args.format)
+        print("Wrote {} shards".format(len(shard_fnames)))
@@ -0,0 +1,446 @@
+"""
+Agreement coefficients for set-valued annotations
+
+@author Nicholas Miller
+
+A drop-in replacement for the parts of nltk's AnnotationTask that iaa.py uses
+(C, I, K, data, Nk, Ao, avg_Ao, pi, kappa, alpha), for labels that are
+frozensets of tags. Each distinct label set is encoded as a row of a boolean
+matrix over the tag vocabulary, so the Jaccard or MASI distance between every
+pair of label sets is computed once, with matrix products, and all the
+coefficients are derived from that distance matrix and label counts.
+
+The formulas follow nltk.metrics.agreement, so results match nltk to within
+floating-point tolerance.
+"""
+from __future__ import division
+import copy
+import math
+import multiprocessing
+import numpy
+from collections import Counter
+from itertools import combinations
+
+
+def jaccard_matrix(intersections, sizes):
+    """Jaccard distance between every pair of label sets
+    Args:
+        intersections: matrix of intersection sizes between label sets
+        sizes: vector of label set sizes
+    Returns:
+        matrix of distances
+    """
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    #Two empty label sets are identical, so their distance is 0
+    safe_unions = numpy.where(unions == 0, 1, unions)
+    return (unions - intersections) / safe_unions
+
+def masi_matrix(intersections, sizes):
+    """MASI distance between every pair of label sets
+    Args:
+        intersections: matrix of intersection sizes between label sets
+        sizes: vector of label set sizes
+    Returns:
+        matrix of distances
+    """
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    safe_unions = numpy.where(unions == 0, 1, unions)
+    size1 = sizes[:, None]
+    size2 = sizes[None, :]
+    #Monotonicity weight: identical, subset, overlap, or disjoint
+    m = numpy.where((size1 == size2) & (size1 == intersections), 1.0,
+        numpy.where(intersections == numpy.minimum(size1, size2), 2 / 3,
+        numpy.where(intersections > 0, 1 / 3, 0.0)))
+    return 1 - intersections / safe_unions * m
+
+DISTANCES = {'jaccard': jaccard_matrix, 'masi': masi_matrix}
+
+def label_distance(distance, label1, label2):
+    """Distance between two label sets, using the same formulas as the matrices above"""
+    overlap = len(label1 & label2)
+    intersections = numpy.array([[len(label1), overlap], [overlap, len(label2)]])
+    sizes = numpy.array([len(label1), len(label2)])
+    return float(DISTANCES[distance](intersections, sizes)[0, 1])
+
+def chance_corrected(observed, expected):
+    """Same handling of the degenerate expected == 1 case as nltk"""
+    if math.isclose(expected, 1.0):
+        if math.isclose(observed, 1.0):
+            return 1.0
+        raise ValueError("Expected agreement is 1.0 but observed agreement is {:.4f}".format(observed))
+    return (observed - expected) / (1.0 - expected)
+
+
+class SetAnnotationTask:
+    """Annotation task for set-valued labels
+    Args:
+        data: sequence of (coder, item, labels) triples, labels being frozensets
+        distance: 'jaccard' or 'masi'
+    """
+    def __init__(self, data=None, distance='jaccard'):
+        if distance not in DISTANCES:
+            raise ValueError("Unknown distance: {}".format(distance))
+        self.distance = distance
+        self.I = set()
+        self.K = set()
+        self.C = set()
+        self.data = []
+        self.encoded = False
+        if data is not None:
+            self.load_array(data)
+
+    def load_array(self, array):
+        """Load a sequence of (coder, item, labels) triples, appending to any data already loaded"""
+        for coder, item, labels in array:
+            self.C.add(coder)
+            self.K.add(labels)
+            self.I.add(item)
+            self.data.append({'coder': coder, 'labels': labels, 'item': item})
+        self.encoded = False
+
+    def encode(self):
+        """Encode the data as integer codes, and compute the distance matrix once"""
+        if self.encoded:
+            return
+        self.coders = sorted(self.C)
+        self.items = sorted(self.I)
+        self.labels = list(self.K)
+        coder_codes = {coder: i for i, coder in enumerate(self.coders)}
+        item_codes = {item: i for i, item in enumerate(self.items)}
+        label_codes = {label: i for i, label in enumerate(self.labels)}
+        self.coder_codes = coder_codes
+        self.label_codes = label_codes
+
+        #Label sets as rows of a boolean matrix over the tag vocabulary
+        tags = sorted(set().union(*self.labels)) if self.labels else []
+        tag_codes = {tag: i for i, tag in enumerate(tags)}
+        incidence = numpy.zeros((len(self.labels), len(tags)), dtype=numpy.int64)
+        for label, k in label_codes.items():
+            for tag in label:
+                incidence[k, tag_codes[tag]] = 1
+        intersections = incidence.dot(incidence.T)
+        sizes = incidence.sum(axis=1)
+        self.distances = DISTANCES[self.distance](intersections, sizes)
+
+        #assignments[i, c] is the label code coder c gave item i, or -1 if none
+        assignments = numpy.full((len(self.items), len(self.coders)), -1, dtype=numpy.int64)
+        for annotation in self.data:
+            i = item_codes[annotation['item']]
+            c = coder_codes[annotation['coder']]
+            assignments[i, c] = label_codes[annotation['labels']]
+        self.set_assignments(assignments)
+        self.encoded = True
+
+    def set_assignments(self, assignments):
+        """Use the given items x coders matrix of label codes, and count the labels in it"""
+        self.assignments = assignments
+        self.n_items = assignments.shape[0]
+        n_labels = len(self.labels)
+        #coder_label_counts[k, c] and item_label_counts[i, k] are annotation counts
+        self.coder_label_counts = numpy.zeros((n_labels, len(self.coders)))
+        for c in range(len(self.coders)):
+            coder_labels = assignments[:, c]
+            self.coder_label_counts[:, c] = numpy.bincount(
+                coder_labels[coder_labels >= 0], minlength=n_labels)
+        rows, cols = numpy.nonzero(assignments >= 0)
+        self.item_label_counts = numpy.bincount(
+            rows * n_labels + assignments[rows, cols],
+            minlength=self.n_items * n_labels).reshape(self.n_items, n_labels).astype(float)
+        self.pair_cache = dict()
+
+    def resample(self, rows):
+        """Return a copy of the task over the given item rows, repeats allowed
+        Only the encoding is gathered, so this is cheap enough for bootstrapping
+        """
+        self.encode()
+        sample = copy.copy(self)
+        sample.set_assignments(self.assignments[rows])
+        return sample
+
+    def Nk(self, k):
+        """Number of annotations with label k"""
+        self.encode()
+        if k not in self.label_codes:
+            return 0.0
+        return float(self.coder_label_counts[self.label_codes[k]].sum())
+
+    def pair_agreement(self, a, b):
+        """Observed agreement between coder codes a and b, computed once per pair"""
+        if (a, b) not in self.pair_cache:
+            labels_a = self.assignments[:, a]
+            labels_b = self.assignments[:, b]
+            both = (labels_a >= 0) & (labels_b >= 0)
+            agreement = 1.0 - self.distances[labels_a[both], labels_b[both]]
+            self.pair_cache[(a, b)] = self.pair_cache[(b, a)] = agreement.sum() / self.n_items
+        return self.pair_cache[(a, b)]
+
+    def Ao(self, cA, cB):
+        """Observed agreement between two coders on all items"""
+        self.encode()
+        return float(self.pair_agreement(self.coder_codes[cA], self.coder_codes[cB]))
+
+    def coder_pairs(self):
+        self.encode()
+        return list(combinations(range(len(self.coders)), 2))
+
+    def avg_Ao(self):
+        """Average observed agreement across all coders and items"""
+        pairs = self.coder_pairs()
+        return sum(self.pair_agreement(a, b) for a, b in pairs) / len(pairs)
+
+    def pi(self):
+        """Scott 1955; here, multi-pi"""
+        self.encode()
+        label_freqs = self.coder_label_counts.sum(axis=1)
+        expected = (label_freqs ** 2).sum() / ((self.n_items * len(self.coders)) ** 2)
+        return float(chance_corrected(self.avg_Ao(), expected))
+
+    def kappa(self):
+        """Cohen 1960, averaged naively over kappas for each coder pair"""
+        pairs = self.coder_pairs()
+        nitems = float(self.n_items)
+        total = 0.0
+        for a, b in pairs:
+            expected = (self.coder_label_counts[:, a] / nitems).dot(self.coder_label_counts[:, b] / nitems)
+            total += chance_corrected(self.pair_agreement(a, b), expected)
+        return float(total / len(pairs))
+
+    def disagreement(self, label_freqs):
+        total_labels = label_freqs.sum()
+        pairs = label_freqs.dot(self.distances).dot(label_freqs)
+        return pairs / (total_labels * (total_labels - 1))
+
+    def alpha(self):
+        """Krippendorff 1980"""
+        self.encode()
+        #Only count labels that were used, since a resampled task may not use them all
+        n_labels = numpy.count_nonzero(self.coder_label_counts.sum(axis=1))
+        if n_labels == 0:
+            raise ValueError("Cannot calculate alpha, no data present!")
+        if n_labels == 1:
+            return 1
+        if len(self.coders) == 1 and self.n_items == 1:
+            raise ValueError("Cannot calculate alpha, only one coder and item present!")
+
+        labels_count = self.item_label_counts.sum(axis=1)
+        valid = self.item_label_counts[labels_count >= 2]
+        valid_count = labels_count[labels_count >= 2]
+        all_valid_labels_freq = valid.sum(axis=0)
+        if numpy.count_nonzero(all_valid_labels_freq) == 1:
+            return 1
+        #Each item's disagreement, times its number of labels
+        item_disagreement = (valid.dot(self.distances) * valid).sum(axis=1) / (valid_count - 1)
+        observed = item_disagreement.sum() / all_valid_labels_freq.sum()
+        expected = self.disagreement(all_valid_labels_freq)
+        return float(1.0 - observed / expected)
+
+
+class IncrementalAgreement:
+    """Agreement statistics that are updated one annotation at a time
+    Keeps the sufficient statistics for Ao, pi, kappa and alpha: per-item and
+    per-coder label counts, the observed agreement summed for each coder pair,
+    and each item's contribution to alpha's observed disagreement.
+    As in iaa.py, a coder that gave an item no tags is counted as giving it
+    the default label, so adding a row costs O(coders), or O(items) for the
+    first row of a new coder.
+    Args:
+        distance: 'jaccard' or 'masi'
+        default: label for (item, coder) pairs with no tags
+    """
+    def __init__(self, distance='jaccard', default=frozenset(['NONE'])):
+        self.distance = distance
+        self.default = default
+        self.I = set()
+        self.C = set()
+        self.tags = dict() #{(item, coder): set of tags}
+        self.labels = dict() #{(item, coder): label, with the default filled in}
+        self.label_freqs = Counter() #{label: count}
+        self.coder_label_freqs = dict() #{coder: Counter of labels}
+        self.item_label_freqs = dict() #{item: Counter of labels}
+        self.item_disagreement = dict() #{item: observed disagreement times labels}
+        self.total_disagreement = 0.0
+        self.valid_label_freqs = Counter() #labels of items with at least 2 labels
+        self.pair_agreement = dict() #{(coder, coder): summed agreement over items}
+        self.distances = dict() #{(label, label): distance}
+
+    @property
+    def K(self):
+        return set(self.label_freqs)
+
+    def label_distance(self, label1, label2):
+        if (label1, label2) not in self.distances:
+            self.distances[(label1, label2)] = self.distances[(label2, label1)] = \
+                label_distance(self.distance, label1, label2)
+        return self.distances[(label1, label2)]
+
+    def add_annotation(self, item, coder, tag):
+        """Add one (item, coder, tag) row"""
+        if coder not in self.C:
+            self.C.add(coder)
+            self.coder_label_freqs[coder] = Counter()
+            for known_item in self.I:
+                self.set_label(known_item, coder, self.default)
+        if item not in self.I:
+            self.I.add(item)
+            self.item_label_freqs[item] = Counter()
+            for known_coder in self.C:
+                self.set_label(item, known_coder, self.default)
+        tags = self.tags.setdefault((item, coder), set())
+        tags.add(tag)
+        self.set_label(item, coder, frozenset(tags))
+
+    def set_label(self, item, coder, label):
+        """Change the label coder gave to item, updating the statistics"""
+        old = self.labels.get((item, coder))
+        if old == label:
+            return
+        self.labels[(item, coder)] = label
+
+        #Pairwise agreement with every other coder of this item
+        for other in self.C:
+            other_label = self.labels.get((item, other))
+            if other == coder or other_label is None:
+                continue
+            pair = tuple(sorted((coder, other)))
+            total = self.pair_agreement.get(pair, 0.0)
+            if old is not None:
+                total -= 1.0 - self.label_distance(old, other_label)
+            total += 1.0 - self.label_distance(label, other_label)
+            self.pair_agreement[pair] = total
+
+        #Label counts, and this item's share of alpha's disagreement
+        item_freqs = self.item_label_freqs[item]
+        if sum(item_freqs.values()) >= 2:
+            self.total_disagreement -= self.item_disagreement.pop(item)
+            self.valid_label_freqs.subtract(item_freqs)
+        if old is not None:
+            self.label_freqs.subtract([old])
+            self.coder_label_freqs[coder].subtract([old])
+            item_freqs.subtract([old])
+            for freqs in (self.label_freqs, self.coder_label_freqs[coder], item_freqs):
+                if freqs[old] == 0:
+                    del freqs[old]
+        self.label_freqs[label] += 1
+        self.coder_label_freqs[coder][label] += 1
+        item_freqs[label] += 1
+        labels_count = sum(item_freqs.values())
+        if labels_count >= 2:
+            self.item_disagreement[item] = self.disagreement(item_freqs) * labels_count
+            self.total_disagreement += self.item_disagreement[item]
+            self.valid_label_freqs.update(item_freqs)
+        self.valid_label_freqs = +self.valid_label_freqs
+
+    def disagreement(self, label_freqs):
+        total_labels = sum(label_freqs.values())
+        pairs = 0.0
+        for j, nj in label_freqs.items():
+            for l, nl in label_freqs.items():
+                pairs += float(nj * nl) * self.label_distance(l, j)
+        return pairs / (total_labels * (total_labels - 1))
+
+    def Nk(self, k):
+        """Number of annotations with label k"""
+        return float(self.label_freqs.get(k, 0))
+
+    def Ao(self, cA, cB):
+        """Observed agreement between two coders on all items"""
+        return self.pair_agreement.get(tuple(sorted((cA, cB))), 0.0) / len(self.I)
+
+    def avg_Ao(self):
+        """Average observed agreement across all coders and items"""
+        pairs = list(combinations(self.C, 2))
+        return sum(self.Ao(cA, cB) for cA, cB in pairs) / len(pairs)
+
+    def pi(self):
+        """Scott 1955; here, multi-pi"""
+        total = sum(f ** 2 for f in self.label_freqs.values())
+        expected = total / ((len(self.I) * len(self.C)) ** 2)
+        return chance_corrected(self.avg_Ao(), expected)
+
+    def kappa(self):
+        """Cohen 1960, averaged naively over kappas for each coder pair"""
+        pairs = list(combinations(self.C, 2))
+        nitems = float(len(self.I))
+        total = 0.0
+        for cA, cB in pairs:
+            freqs_a = self.coder_label_freqs[cA]
+            freqs_b = self.coder_label_freqs[cB]
+            expected = sum((freqs_a[k] / nitems) * (freqs_b[k] / nitems) for k in freqs_a)
+            total += chance_corrected(self.Ao(cA, cB), expected)
+        return total / len(pairs)
+
+    def alpha(self):
+        """Krippendorff 1980"""
+        if len(self.label_freqs) == 0:
+            raise ValueError("Cannot calculate alpha, no data present!")
+        if len(self.label_freqs) == 1:
+            return 1
+        if len(self.C) == 1 and len(self.I) == 1:
+            raise ValueError("Cannot calculate alpha, only one coder and item present!")
+        if len(self.valid_label_freqs) == 1:
+            return 1
+        observed = self.total_disagreement / sum(self.valid_label_freqs.values())
+        expected = self.disagreement(self.valid_label_freqs)
+        return 1.0 - observed / expected
+
+
+#Task shared with the bootstrap worker processes, set by init_bootstrap_worker
+worker_task = None
+
+def init_bootstrap_worker(task):
+    global worker_task
+    worker_task = task
+
+def bootstrap_chunk(chunk):
+    """Compute (pi, alpha, kappa) for a chunk of bootstrap replicates
+    Args:
+        chunk: (numpy SeedSequence, number of replicates)
+    Returns:
+        replicates x 3 array, with nan where a coefficient is undefined
+    """
+    seed, count = chunk
+    rng = numpy.random.default_rng(seed)
+    results = numpy.full((count, 3), numpy.nan)
+    n_items = worker_task.n_items
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for r in range(count):
+            sample = worker_task.resample(rng.integers(0, n_items, n_items))
+            for j, coefficient in enumerate((sample.pi, sample.alpha, sample.kappa)):
+                try:
+                    results[r, j] = coefficient()
+                except (ValueError, ZeroDivisionError):
+                    pass
+    return results
+
+def bootstrap(task, replicates, jobs=1, seed=None, confidence=0.95):
+    """Bootstrap confidence intervals for pi, alpha and kappa
+    Items are resampled with replacement, reusing the task's encoding
+    Args:
+        task: SetAnnotationTask
+        replicates: number of bootstrap replicates
+        jobs: number of processes
+        seed: seed for the random number generator, for reproducible intervals
+        confidence: width of the intervals
+    Returns:
+        a dict of the form {'pi': (low, high), 'alpha': (low, high), 'kappa': (low, high)}
+    """
+    task.encode()
+    #Same chunks and seeds whatever the number of jobs, so results only depend on the seed
+    n_chunks = max(1, min(replicates, 64))
+    seeds = numpy.random.SeedSequence(seed).spawn(n_chunks)
+    chunks = [(seeds[i], replicates // n_chunks + (1 if i < replicates % n_chunks else 0))
+              for i in range(n_chunks)]
+
+    if jobs > 1:
+        with multiprocessing.Pool(jobs, init_bootstrap_worker, (task,)) as pool:
+            results = numpy.vstack(pool.map(bootstrap_chunk, chunks))
+    else:
+        init_bootstrap_worker(task)
+        results = numpy.vstack([bootstrap_chunk(chunk) for chunk in chunks])
+
+    tail = (1 - confidence) / 2 * 100
+    intervals = dict()
+    for j, name in enumerate(('pi', 'alpha', 'kappa')):
+        low, high = numpy.nanpercentile(results[:, j], [tail, 100 - tail])
+        intervals[name] = (float(low), float(high))
+    return intervals
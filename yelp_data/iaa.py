@@ -3,15 +3,21 @@ Tool for calculating inter-annotator agreement on yelp reviews
 
 @author Nicholas Miller
 
-Input: A .csv file of each user's annotations.
+Input: .csv files of each user's annotations.
 
 How to run (arguments in parentheses are optional):
 
-python agreement.py <input.csv> (<options>) (> <output.txt>)
+python iaa.py <input.csv> (<input2.csv> ...) (<options>) (> <output.txt>)
 
-<input.csv> : the path to the input .csv file
+<input.csv> : the path to an input .csv file, or a directory of them
 <options>:
 -c : include this option if you want the script to print the tag counts
+-j N : parse the input files (and run bootstrap replicates) with N processes
+-b N : print 95% bootstrap confidence intervals from N replicates
+-s SEED : random seed for the bootstrap replicates
+-i : incremental mode, only read the rows added to <input.csv> since the last run
+     (statistics are kept in <input.csv>.iaa_state, or the file given by --state)
+-n : use nltk's AnnotationTask instead of the faster agreement.SetAnnotationTask
 <output.txt> (optional): the file you want the results printed to.
 
 """
@@ -22,18 +28,38 @@ import numpy
 import os
 import sys
 import datetime
+import multiprocessing
+import pickle
 import codecs #for solving 'null byte' error when opening file
 from itertools import combinations, product
 from nltk.metrics.agreement import AnnotationTask
 from nltk.metrics.distance import masi_distance
 from nltk.metrics.distance import jaccard_distance
+from agreement import SetAnnotationTask, IncrementalAgreement, bootstrap
 
-def get_annotation_dicts(csv_source):
-    """Process double tags, assuming comment-level only
+def find_annotation_files(sources):
+    """Expand directories into the .csv files they contain
+    Args:
+        sources: list of paths to csv files or directories of csv files
+    Returns:
+        list of paths to csv files
+    """
+    csv_files = list()
+    for source in sources:
+        if os.path.isdir(source):
+            csv_files.extend(sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.lower().endswith('.csv')))
+        else:
+            csv_files.append(source)
+    return csv_files
+
+def read_annotation_file(csv_source):
+    """Read the tags in one csv file, one row at a time
     Args:
         csv_source: path to source csv file
     Returns:
-        tag_dict: a dict of the form {(file, ant): (set of tags)}
+        tag_dict: a dict of the form {(file, ant): set of tags}
     """
     with codecs.open(csv_source, encoding='utf-8', errors='replace') as source:
         tag_dict = dict() #{(file, ant): set()}
@@ -50,40 +76,135 @@ def get_annotation_dicts(csv_source):
             if tag is not None and tag != 'METADATA':
                 #Dictionary keys are (filename, annotator)
                 #Dictionary values are {set of tags}
-                try:
-                    tag_dict[(filename, ant)].add(tag)
-                except KeyError:
-                    tag_dict[(filename,ant)] = set()
-                    tag_dict[(filename, ant)].add(tag)
+                tag_dict.setdefault((filename, ant), set()).add(tag)
+
+    return tag_dict
+
+def get_annotation_dicts(csv_sources, jobs=1):
+    """Process double tags, assuming comment-level only
+    Args:
+        csv_sources: path to source csv file or directory, or a list of them
+        jobs: number of processes used to parse the files
+    Returns:
+        tag_dict: a dict of the form {(file, ant): (set of tags)}
+    """
+    if isinstance(csv_sources, str):
+        csv_sources = [csv_sources]
+    csv_files = find_annotation_files(csv_sources)
 
-        #Convert to frozenset since masi distance needs immutable
-        for key in tag_dict.keys():
-            tag_dict[key] = frozenset(tag_dict[key])
+    if jobs > 1 and len(csv_files) > 1:
+        with multiprocessing.Pool(min(jobs, len(csv_files))) as pool:
+            file_dicts = pool.imap(read_annotation_file, csv_files)
+            tag_dict = merge_annotation_dicts(file_dicts)
+    else:
+        tag_dict = merge_annotation_dicts(read_annotation_file(f) for f in csv_files)
+
+    #Convert to frozenset since masi distance needs immutable
+    for key in tag_dict.keys():
+        tag_dict[key] = frozenset(tag_dict[key])
 
     return tag_dict
 
-def create_annotation_task(tag_dict):
+def merge_annotation_dicts(file_dicts):
+    """Combine the tag dicts of several files, taking the union of the tags"""
+    tag_dict = dict()
+    for file_dict in file_dicts:
+        for key, tags in file_dict.items():
+            tag_dict.setdefault(key, set()).update(tags)
+    return tag_dict
+
+def fill_missing(tag_dict, default=frozenset(['NONE'])):
+    """Give every (file, ant) pair that has no tags the default tag
+    Args:
+        tag_dict: a dict of the form {(file, ant): (set of tags)}, changed in place
+    Returns:
+        missing: list of the (file, ant) pairs that were filled in
+    """
+    filenames = set(filename for filename, ant in tag_dict)
+    ants = set(ant for filename, ant in tag_dict)
+    missing = list()
+    for filename in filenames:
+        for ant in ants:
+            if (filename, ant) not in tag_dict:
+                missing.append((filename, ant))
+                print("Filling in default value for ({}, {})".format(filename, ant))
+                tag_dict[(filename, ant)] = default
+    return missing
+
+def update_incremental(csv_source, state_path=None):
+    """Update saved agreement statistics with the rows added to csv_source
+    since the last run, and save them again
+    Args:
+        csv_source: path to source csv file, which annotators append rows to
+        state_path: where the statistics are kept, default <csv_source>.iaa_state
+    Returns:
+        stats: IncrementalAgreement, which has the same agreement methods as a task
+        new_rows: number of rows read this time
+    """
+    state_path = state_path or csv_source + '.iaa_state'
+    try:
+        with open(state_path, 'rb') as source:
+            state = pickle.load(source)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        state = None
+    #Start over if the file got shorter, since then it wasn't just appended to
+    if state is None or os.path.getsize(csv_source) < state['offset']:
+        state = {'offset': 0, 'fieldnames': None, 'stats': IncrementalAgreement()}
+
+    with open(csv_source, 'rb') as source:
+        source.seek(state['offset'])
+        new_bytes = source.read()
+    #Leave a partly written last row for next time
+    new_bytes = new_bytes[:new_bytes.rfind(b'\n') + 1]
+    lines = new_bytes.decode('utf-8', errors='replace').splitlines(True)
+
+    reader = csv.DictReader(lines, fieldnames=state['fieldnames'])
+    new_rows = 0
+    for row in reader:
+        new_rows += 1
+        tag = row['Tag']
+        #Skip metadata, since we're assuming annotators will agree on that
+        if tag is not None and tag != 'METADATA':
+            state['stats'].add_annotation(row['File'], row['Ant'], tag)
+    state['fieldnames'] = reader.fieldnames
+    state['offset'] += len(new_bytes)
+
+    with open(state_path, 'wb') as dest:
+        pickle.dump(state, dest)
+    return state['stats'], new_rows
+
+def create_annotation_task(tag_dict, use_nltk=False):
     """Creates an AnnotationTask object and loads it with data from the given
     tag_dict
     Args
         tag_dict
+        use_nltk: use nltk's AnnotationTask instead of SetAnnotationTask
     Returns:
         An annotation task object with each item consisting of the annotated
         file's name combined with the sentence number or 'R' for top-level
         tags.
     """
-    #Since we're dealing with sets of labels, use Jaccard or MASI for distance
-    #task = AnnotationTask(distance=masi_distance)
-    task = AnnotationTask(distance=jaccard_distance)
+    #(ant, file, frozenset of tags) triples, loaded all at once
+    triples = [(ant, filename, tag) for (filename, ant), tag in tag_dict.items()]
 
-    reader = None
+    #Since we're dealing with sets of labels, use Jaccard or MASI for distance
+    if use_nltk:
+        #task = AnnotationTask(data=triples, distance=masi_distance)
+        return AnnotationTask(data=triples, distance=jaccard_distance)
+    #task = SetAnnotationTask(data=triples, distance='masi')
+    return SetAnnotationTask(data=triples, distance='jaccard')
 
-    for key in tag_dict.keys(): #(file, ant)
-            filename = key[0] #str
-            ant = key[1] #str
-            tag = tag_dict[key] #frozenset of tags
-            task.load_array([(ant, filename, tag)])
-    return task
+def count_items(task):
+    """Count how many annotations each item received
+    Args:
+        task: AnnotationTask
+    Returns:
+        item_counts: a dict of the form {item: number of annotations}
+    """
+    item_counts = dict()
+    for annotation in task.data:
+        item_counts[annotation['item']] = item_counts.get(annotation['item'], 0) + 1
+    return item_counts
 
 def per_tag_agreement(task):
     """Calculate the agreement for each label,
@@ -91,14 +212,17 @@ def per_tag_agreement(task):
     then for each item with that label, find the number of times
     the item received exactly that label, and divide by all the labels for the item
     """
+    item_counts = count_items(task)
+
+    #{label: [item of each annotation with exactly that label]}
+    label_items = dict()
+    for annotation in task.data:
+        label_items.setdefault(annotation['labels'], []).append(annotation['item'])
+
     for label in task.K:
-        match_label = [item for item in task.data if item['labels'] == label]
-        #match_label = [item for item in task.data if item['labels'].intersection(label)]
-        match_label_items = set([item['item'] for item in match_label])
+        match_label = label_items.get(label, [])
         match_count = len(match_label)
-        total_count = 0
-        for match_label_item in match_label_items:
-            total_count += len([item for item in task.data if item['item'] == match_label_item])
+        total_count = sum(item_counts[item] for item in set(match_label))
         match_score = match_count / float(total_count)
         print("Agreement for [{}]: {}/{} ({})".format(','.join(label), match_count, total_count, match_score))
 
@@ -108,15 +232,21 @@ def per_tag_intersection(task):
     then for each item with that label, find the number of times
     the item was given a set of labels that intersect with k, and divide by all the labels for the item
     """
+    item_counts = count_items(task)
+
+    #{tag: set of positions in task.data of annotations including that tag}
+    tag_annotations = dict()
+    for position, annotation in enumerate(task.data):
+        for tag in annotation['labels']:
+            tag_annotations.setdefault(tag, set()).add(position)
 
     for label in task.K:
-        #match_label = [item for item in task.data if item['labels'] == label]
-        match_label = [item for item in task.data if item['labels'].intersection(label)]
-        match_label_items = set([item['item'] for item in match_label])
+        match_label = set()
+        for tag in label:
+            match_label.update(tag_annotations.get(tag, ()))
+        match_label_items = set([task.data[position]['item'] for position in match_label])
         match_count = len(match_label)
-        total_count = 0
-        for match_label_item in match_label_items:
-            total_count += len([item for item in task.data if item['item'] == match_label_item])
+        total_count = sum(item_counts[item] for item in match_label_items)
         match_score = match_count / float(total_count)
         print("Intersection agreement for [{}]: {}/{} ({})".format(','.join(label), match_count, total_count, match_score))
 
@@ -124,9 +254,15 @@ def per_tag_intersection(task):
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Calculate IAA')
-    parser.add_argument('source')
+    parser.add_argument('source', nargs='+')
     parser.add_argument('-c', '--counts', action='store_true')
     parser.add_argument('-a', '--agreement', action='store_true')
+    parser.add_argument('-n', '--nltk', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-b', '--bootstrap', type=int, default=0)
+    parser.add_argument('-s', '--seed', type=int, default=None)
+    parser.add_argument('-i', '--incremental', action='store_true')
+    parser.add_argument('--state', default=None)
 
     args = parser.parse_args()
 
@@ -137,18 +273,24 @@ if __name__ == '__main__':
         print_counts = args.counts
         print_agreement = args.agreement
 
-    source_path = args.source
-    tag_dict = get_annotation_dicts(source_path)
-    tag_task = create_annotation_task(tag_dict)
-    #Find missing tags
-    missing = list()
-    for filename in tag_task.I:
-        for ant in tag_task.C:
-            if (filename, ant) not in tag_dict.keys():
-                missing.append((filename, ant))
-                print("Filling in default value for ({}, {})".format(filename, ant))
-                tag_dict[(filename, ant)] = (frozenset(['NONE']))
-    tag_task = create_annotation_task(tag_dict)
+    source_paths = args.source
+    if args.incremental:
+        #The saved state belongs to one growing csv
+        if len(source_paths) > 1 or os.path.isdir(source_paths[0]):
+            parser.error('-i/--incremental takes a single csv file, not {}'.format(' '.join(source_paths)))
+        #Per-tag agreement, nltk and the bootstrap need every annotation,
+        #and one file is read by one process
+        for flag, used in (('-a/--agreement', args.agreement), ('-n/--nltk', args.nltk),
+                           ('-b/--bootstrap', args.bootstrap), ('-j/--jobs', args.jobs != 1)):
+            if used:
+                parser.error('{} can\'t be used with -i/--incremental'.format(flag))
+        tag_task, new_rows = update_incremental(source_paths[0], args.state)
+        print("Read {} new rows from {}".format(new_rows, source_paths[0]))
+    else:
+        tag_dict = get_annotation_dicts(source_paths, args.jobs)
+        #Find missing tags
+        missing = fill_missing(tag_dict)
+        tag_task = create_annotation_task(tag_dict, args.nltk)
     print("\n")
 
     tasks = {'tag': tag_task}
@@ -170,4 +312,10 @@ if __name__ == '__main__':
         print("Pi: {}".format(tasks[task].pi()))
         print("Alpha: {}".format(tasks[task].alpha()))
         print("Kappa: {}".format(tasks[task].kappa()))
+        if args.bootstrap:
+            #The bootstrap always uses SetAnnotationTask, since it resamples its encoding
+            intervals = bootstrap(create_annotation_task(tag_dict), args.bootstrap, args.jobs, args.seed)
+            print("{} bootstrap replicates, 95% confidence intervals:".format(args.bootstrap))
+            for coefficient in ('pi', 'alpha', 'kappa'):
+                print("{}: ({}, {})".format(coefficient.capitalize(), *intervals[coefficient]))
         print("\n")
@@ -0,0 +1,68 @@
+"""
+Parity tests for agreement.py against nltk's AnnotationTask
+
+Run with: python -m pytest test_agreement.py
+"""
+import random
+from itertools import combinations
+
+import pytest
+
+from agreement import IncrementalAgreement, SetAnnotationTask
+
+agreement_metrics = pytest.importorskip("nltk.metrics.agreement")
+nltk_distance = pytest.importorskip("nltk.metrics.distance")
+
+TAGS = ['PER', 'LOC', 'ORG', 'DATE', 'MISC']
+DEFAULT = frozenset(['NONE'])
+
+def synthetic_export(seed=0, items=40, coders=('ant1', 'ant2', 'ant3')):
+    """(item, coder, tag) rows like an annotation export, with some (item, coder) pairs left out"""
+    rng = random.Random(seed)
+    rows = []
+    for item in range(items):
+        for coder in coders:
+            if rng.random() < 0.15:
+                continue
+            for tag in rng.sample(TAGS, rng.randint(1, 3)):
+                rows.append(('file{0}'.format(item), coder, tag))
+    rng.shuffle(rows)
+    return rows
+
+def label_triples(rows):
+    """(coder, item, label) triples with the default label filled in, as iaa.py does"""
+    tags = {}
+    for item, coder, tag in rows:
+        tags.setdefault((item, coder), set()).add(tag)
+    items = sorted(set(item for item, coder, tag in rows))
+    coders = sorted(set(coder for item, coder, tag in rows))
+    return [(coder, item, frozenset(tags.get((item, coder), DEFAULT)))
+            for item in items for coder in coders]
+
+def assert_same_coefficients(ours, theirs):
+    assert ours.pi() == pytest.approx(theirs.pi(), abs=1e-12)
+    assert ours.kappa() == pytest.approx(theirs.kappa(), abs=1e-12)
+    assert ours.alpha() == pytest.approx(theirs.alpha(), abs=1e-12)
+    assert ours.avg_Ao() == pytest.approx(theirs.avg_Ao(), abs=1e-12)
+    for cA, cB in combinations(sorted(theirs.C), 2):
+        assert ours.Ao(cA, cB) == pytest.approx(theirs.Ao(cA, cB), abs=1e-12)
+
+@pytest.mark.parametrize('distance', ['jaccard', 'masi'])
+def test_matches_nltk(distance):
+    triples = label_triples(synthetic_export())
+    ours = SetAnnotationTask(data=triples, distance=distance)
+    theirs = agreement_metrics.AnnotationTask(
+        data=triples, distance=getattr(nltk_distance, distance + '_distance'))
+    assert_same_coefficients(ours, theirs)
+
+@pytest.mark.parametrize('distance', ['jaccard', 'masi'])
+def test_incremental_matches_batch(distance):
+    rows = synthetic_export(seed=1)
+    incremental = IncrementalAgreement(distance=distance, default=DEFAULT)
+    #Append the rows in two parts, checking against the batch result after each
+    middle = len(rows) // 2
+    for start, end in ((0, middle), (middle, len(rows))):
+        for item, coder, tag in rows[start:end]:
+            incremental.add_annotation(item, coder, tag)
+        batch = SetAnnotationTask(data=label_triples(rows[:end]), distance=distance)
+        assert_same_coefficients(incremental, batch)
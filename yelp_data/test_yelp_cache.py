@@ -0,0 +1,63 @@
+"""
+Tests of the columnar cache in yelp_cache.py, against the plain JSON files it's built from
+Run with: python -m pytest test_yelp_cache.py
+"""
+
+import json
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from test_yelp_dataset_tools import BUSINESSES, WANTED, synthetic_reviews
+from yelp_cache import ColumnCache
+from yelp_dataset_tools import BusinessIndex, ReviewParser
+
+CATEGORIES = [['Hospitals', 'Health'], ['Bars'], None, ['Health & Medical', 'Hospitals'], []]
+
+def cache_reviews():
+    """The synthetic reviews, plus the fields the cache has to fall back to json for"""
+    reviews = synthetic_reviews()
+    reviews[10]['stars'] = None
+    reviews[11]['stars'] = 4.5
+    reviews[12]['date'] = None
+    del reviews[13]['date']
+    reviews[14]['date'] = '2016-02-29 23:59:59'
+    #Keys in another order, with no spaces
+    reviews[15] = {'text': 'Odd "stars": 1 layout', 'date': '2015-07-04', 'stars': 2,
+                   'business_id': 'b4', 'review_id': 'r15'}
+    return reviews
+
+@pytest.fixture
+def cache(tmp_path):
+    business_path = str(tmp_path / 'business.json')
+    review_path = str(tmp_path / 'review.json')
+    with open(business_path, 'w', encoding='utf-8') as dest:
+        for i, business_id in enumerate(BUSINESSES):
+            dest.write(json.dumps({'business_id': business_id, 'categories': CATEGORIES[i % len(CATEGORIES)]}) + '\n')
+    with open(review_path, 'w', encoding='utf-8') as dest:
+        for i, review in enumerate(cache_reviews()):
+            separators = (',', ':') if i % 2 else (', ', ': ')
+            dest.write(json.dumps(review, separators=separators) + '\n')
+    return ColumnCache(str(tmp_path / 'cache'), business_path, review_path).load_or_build()
+
+def test_review_columns(cache):
+    reviews = cache_reviews()
+    assert cache.review_stars.tolist() == [review.get('stars') or 0 for review in reviews]
+    assert [str(day) for day in cache.review_date] == [
+        (review.get('date') or 'NaT')[:10] for review in reviews]
+    codes = cache.review_business.tolist()
+    assert [cache.business_id_dictionary[code] if code >= 0 else None for code in codes] == [
+        review['business_id'] for review in reviews]
+
+def test_cache_matches_parsers(cache):
+    expected = [review for review in cache_reviews() if review['business_id'] in WANTED]
+    assert cache.get_reviews_by_ids(WANTED) == expected
+    assert ReviewParser(cache.review_source, cache=cache).get_reviews_by_ids(WANTED) == expected
+    stars, dates = cache.get_review_columns(WANTED)
+    assert stars.tolist() == [review.get('stars') or 0 for review in expected]
+
+    index = BusinessIndex(cache.business_source)
+    assert cache.category_counts == index.category_counts
+    for match in ('Hospitals', 'Health', 'Bar', 'Zoo'):
+        assert cache.matching_positions(match) == index.matching_positions(match)
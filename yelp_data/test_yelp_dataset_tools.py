@@ -0,0 +1,100 @@
+"""
+Tests of the review scans and writers in yelp_dataset_tools.py, on a small made-up review file
+Run with: python -m pytest test_yelp_dataset_tools.py
+"""
+
+import gzip
+import json
+import random
+
+import pytest
+
+from yelp_dataset_tools import ReviewIndex, ReviewParser, split_lines
+
+BUSINESSES = ['b{0}'.format(i) for i in range(12)]
+WANTED = ['b1', 'b4', 'b7', 'b11', 'not-in-file']
+
+def synthetic_reviews(seed=0, count=300):
+    """Reviews spread over the businesses, with the awkward cases the scans have to handle"""
+    rng = random.Random(seed)
+    reviews = []
+    for i in range(count):
+        reviews.append({
+            'review_id': 'r{0}'.format(i),
+            'business_id': rng.choice(BUSINESSES),
+            'stars': rng.randint(1, 5),
+            'date': '2017-{0:02d}-{1:02d}'.format(rng.randint(1, 12), rng.randint(1, 28)),
+            'text': rng.choice(['Fine.', 'Café ☕', 'Said "great", went back',
+                                'Line one\nline two']),
+        })
+    #A business ID written inside the text, which must not be taken for the real one
+    reviews[5]['text'] = 'Better than "business_id": "b1" down the road'
+    reviews[5]['business_id'] = 'b2'
+    #An escaped character in the ID, and a review with no business
+    reviews[6]['business_id'] = 'bé4'
+    reviews[7]['business_id'] = None
+    return reviews
+
+@pytest.fixture
+def review_path(tmp_path):
+    path = str(tmp_path / 'review.json')
+    with open(path, 'w', encoding='utf-8') as dest:
+        for review in synthetic_reviews():
+            dest.write(json.dumps(review) + '\n')
+    return path
+
+def expected_reviews(ids):
+    return [review for review in synthetic_reviews() if review['business_id'] in ids]
+
+def test_split_lines(review_path):
+    with open(review_path, 'rb') as f:
+        data = f.read()
+    for chunks in (1, 2, 7, 50, 1000):
+        ranges = split_lines(review_path, chunks)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            assert end == next_start
+        for start, end in ranges:
+            assert data[start:end].endswith(b'\n')
+
+def test_scans_match(review_path, tmp_path):
+    ids = WANTED + ['bé4']
+    expected = expected_reviews(ids)
+    assert len(expected) > 50
+
+    rp = ReviewParser(review_path, index_path=str(tmp_path / 'review.idx'))
+    serial = rp.get_reviews_by_ids(ids, use_index=False)
+    assert serial == expected
+    for workers in (2, 3):
+        assert rp.get_reviews_by_ids(ids, use_index=False, workers=workers) == expected
+
+    #With a saved index, only the matching lines are read
+    rp.get_index()
+    assert isinstance(rp.load_index(), ReviewIndex)
+    assert rp.get_reviews_by_ids(ids) == expected
+    assert ReviewParser(review_path, index_path=str(tmp_path / 'review.idx')).get_reviews_by_ids(ids) == expected
+    assert rp.get_reviews_by_ids([]) == []
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_round_trip(review_path, tmp_path, compression):
+    rp = ReviewParser(review_path)
+    expected = expected_reviews(WANTED)
+    opener = gzip.open if compression else open
+
+    json_path = str(tmp_path / 'reviews.json')
+    assert rp.write_to_json(rp.iter_reviews_by_ids(WANTED, use_index=False), json_path, compression) == len(expected)
+    with opener(json_path, 'rt', encoding='utf-8') as source:
+        text = source.read()
+    assert json.loads(text) == expected
+    #The same layout json.dump has always written
+    assert text == json.dumps(expected, indent=2)
+
+    jsonl_path = str(tmp_path / 'reviews.jsonl')
+    assert rp.write_to_jsonl(iter(expected), jsonl_path, compression) == len(expected)
+    with opener(jsonl_path, 'rt', encoding='utf-8') as source:
+        assert [json.loads(line) for line in source] == expected
+
+    empty_path = str(tmp_path / 'empty.json')
+    assert rp.write_to_json([], empty_path, compression) == 0
+    with opener(empty_path, 'rt', encoding='utf-8') as source:
+        assert json.load(source) == []
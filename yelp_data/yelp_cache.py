@@ -0,0 +1,297 @@
+"""
+Name: Nicholas Miller
+Description: column-oriented cache of the Yelp Dataset Challenge JSON files
+The business and review files are converted once into NumPy arrays on disk
+(one file per field, with business IDs and categories dictionary-encoded),
+and later queries run as vectorized operations over memory-mapped columns.
+
+Usage:
+    cache = ColumnCache(cache_dir, business_path, review_path).load_or_build()
+    bp = BusinessParser(business_path, cache=cache)
+    rp = ReviewParser(review_path, cache=cache)
+"""
+
+import datetime
+import json
+import mmap
+import os
+import re
+from array import array
+
+import numpy
+
+from yelp_dataset_tools import get_business_id
+
+#Match the stars and date fields of a raw review line, so the review text never has to be decoded
+#Quotes inside string values are escaped, so these can't match inside the review text
+STARS_PATTERN = re.compile(rb'"stars"\s*:\s*(-?[0-9]+(?:\.[0-9]+)?)\s*[,}]')
+DATE_PATTERN = re.compile(rb'"date"\s*:\s*"([0-9]{4})-([0-9]{2})-([0-9]{2})')
+
+#Days are counted from 1970-01-01, the same as datetime64[D], and NaT is the smallest int64
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+NAT = numpy.iinfo(numpy.int64).min
+
+def get_stars_and_day(line, days):
+    """Get the stars and date (as days since 1970) of a raw review line
+    Input: one line of the review file, as bytes, and a {date bytes: day} dict of dates already seen
+    Output: (stars, day), with 0 for missing stars and NAT for a missing date
+    """
+    stars = STARS_PATTERN.search(line)
+    date = DATE_PATTERN.search(line)
+    if stars is None or date is None:
+        #Missing, null or unusual fields, so let json handle it
+        review = json.loads(line)
+        stars = review.get('stars') or 0
+        date = (review.get('date') or '')[:10]
+        if not date:
+            return stars, NAT
+        return stars, datetime.date.fromisoformat(date).toordinal() - EPOCH
+    key = date.group(0)
+    if key not in days:
+        days[key] = datetime.date(*(int(part) for part in date.groups())).toordinal() - EPOCH
+    return float(stars.group(1)), days[key]
+
+
+class LineReader:
+    """Read lines of a file by position, from their byte offsets and lengths"""
+    def __init__(self, source_path, offsets, lengths):
+        self.source = source_path
+        self.offsets = offsets
+        self.lengths = lengths
+        self.mm = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, position):
+        #The file is mapped on first use and stays mapped, so lookups are cheap
+        if self.mm is None:
+            with open(self.source, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = int(self.offsets[position])
+        length = int(self.lengths[position])
+        return self.mm[offset:offset + length].decode('utf-8')
+
+
+class ColumnCache:
+    """Columnar cache of the business and review files
+    Business columns:
+        business_ids.json: dictionary of business IDs (code -> ID)
+        categories.json: dictionary of category names (code -> name)
+        business_code: business ID code of each business, in file order
+        business_offset, business_length: where each business's line is
+        business_category_start, business_category: category codes of each
+            business, business i has business_category[start[i]:start[i+1]]
+    Review columns:
+        review_business: business ID code of each review (-1 if missing)
+        review_stars, review_date: stars and date of each review
+        review_offset, review_length: where each review's line is
+    It can stand in for a BusinessIndex or a ReviewIndex (see the parsers' cache argument)
+    """
+    version = 1
+
+    def __init__(self, cache_dir, business_path, review_path):
+        self.cache_dir = cache_dir
+        self.business_source = business_path
+        self.review_source = review_path
+        self.match_cache = {}
+
+    def column_path(self, name):
+        return os.path.join(self.cache_dir, name + '.npy')
+
+    def source_stamps(self):
+        """Return the (mtime, size) of both source files, used to invalidate the cache"""
+        stamps = []
+        for source in (self.business_source, self.review_source):
+            stat = os.stat(source)
+            stamps.append([stat.st_mtime_ns, stat.st_size])
+        return stamps
+
+    def load_or_build(self):
+        """Load the cache, converting the JSON files first if it is missing or stale"""
+        if not self.load():
+            self.build()
+            self.load()
+        return self
+
+    def build(self):
+        """Convert the business and review JSON files into columns on disk
+        Review lines aren't decoded: the business ID, stars and date are read from the raw bytes
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        business_codes = {} #{business_id: code}
+        category_codes = {} #{category: code}
+        #Columns are kept as typed arrays until they're saved, not lists of Python objects,
+        #so the review file takes a few bytes per review to convert
+        columns = {
+            'business_code': array('i'),
+            'business_offset': array('q'),
+            'business_length': array('q'),
+            'business_category_start': array('q', [0]),
+            'business_category': array('i'),
+            'review_business': array('i'),
+            'review_stars': array('f'),
+            'review_date': array('q'),
+            'review_offset': array('q'),
+            'review_length': array('q'),
+        }
+
+        offset = 0
+        with open(self.business_source, 'rb') as f:
+            for line in f:
+                business = json.loads(line)
+                columns['business_code'].append(
+                    business_codes.setdefault(business['business_id'], len(business_codes)))
+                columns['business_offset'].append(offset)
+                columns['business_length'].append(len(line))
+                for cat in business['categories'] or []:
+                    columns['business_category'].append(
+                        category_codes.setdefault(cat, len(category_codes)))
+                columns['business_category_start'].append(len(columns['business_category']))
+                offset += len(line)
+        business_count = len(columns['business_offset'])
+
+        #Only the business ID, stars and date are pulled out of each review line,
+        #without decoding the rest of it
+        days = {} #{date bytes: days since 1970}
+        offset = 0
+        with open(self.review_source, 'rb') as f:
+            for line in f:
+                business_id = get_business_id(line)
+                if business_id:
+                    #Reviews can mention businesses missing from the business file
+                    code = business_codes.setdefault(business_id, len(business_codes))
+                else:
+                    code = -1
+                stars, day = get_stars_and_day(line, days)
+                columns['review_business'].append(code)
+                columns['review_stars'].append(stars)
+                columns['review_date'].append(day)
+                columns['review_offset'].append(offset)
+                columns['review_length'].append(len(line))
+                offset += len(line)
+
+        dtypes = {
+            'business_code': numpy.int32,
+            'business_offset': numpy.int64,
+            'business_length': numpy.int64,
+            'business_category_start': numpy.int64,
+            'business_category': numpy.int32,
+            'review_business': numpy.int32,
+            'review_stars': numpy.float32,
+            'review_date': numpy.int64,
+            'review_offset': numpy.int64,
+            'review_length': numpy.int64,
+        }
+        for name, values in columns.items():
+            column = numpy.frombuffer(values, dtype=dtypes[name])
+            if name == 'review_date':
+                column = column.view('datetime64[D]')
+            numpy.save(self.column_path(name), column)
+            #Free each array once it's written
+            columns[name] = None
+
+        #Dictionaries are in code order, since codes were handed out in insertion order
+        with open(os.path.join(self.cache_dir, 'business_ids.json'), 'w') as dest:
+            json.dump(list(business_codes), dest)
+        with open(os.path.join(self.cache_dir, 'categories.json'), 'w') as dest:
+            json.dump(list(category_codes), dest)
+
+        #Written last, so a half-built cache is never mistaken for a good one
+        with open(meta_path, 'w') as dest:
+            json.dump({
+                'version': self.version,
+                'sources': self.source_stamps(),
+                'business_count': business_count,
+            }, dest)
+        return self
+
+    def load(self):
+        """Memory-map the columns, returning False if the cache is missing or stale"""
+        try:
+            with open(os.path.join(self.cache_dir, 'meta.json')) as source:
+                meta = json.load(source)
+        except (OSError, ValueError):
+            return False
+        if meta.get('version') != self.version or meta['sources'] != self.source_stamps():
+            return False
+
+        with open(os.path.join(self.cache_dir, 'business_ids.json')) as source:
+            self.business_id_dictionary = json.load(source)
+        with open(os.path.join(self.cache_dir, 'categories.json')) as source:
+            self.categories = json.load(source)
+        self.business_codes = {business_id: code
+                               for code, business_id in enumerate(self.business_id_dictionary)}
+        self.business_count = meta['business_count']
+
+        for name in ('business_code', 'business_offset', 'business_length', 'business_category_start',
+                     'business_category', 'review_business', 'review_stars',
+                     'review_date', 'review_offset', 'review_length'):
+            setattr(self, name, numpy.load(self.column_path(name), mmap_mode='r'))
+
+        self.business_ids = [self.business_id_dictionary[code] for code in self.business_code.tolist()]
+        self.lines = LineReader(self.business_source, self.business_offset, self.business_length)
+        self.match_cache = {}
+        return True
+
+    #Business queries, the same interface as BusinessIndex
+
+    @property
+    def category_counts(self):
+        """Return {category: count} of all categories"""
+        counts = numpy.bincount(self.business_category, minlength=len(self.categories))
+        return dict(zip(self.categories, counts.tolist()))
+
+    def matching_category_codes(self, match_string):
+        """Return a boolean mask over category codes for names containing match_string"""
+        if match_string not in self.match_cache:
+            self.match_cache[match_string] = numpy.array(
+                [match_string in cat for cat in self.categories], dtype=bool)
+        return self.match_cache[match_string]
+
+    def matching_positions(self, match_string):
+        """Return positions of businesses with a category matching match_string
+        A business appears once per matching category, in file order
+        """
+        mask = self.matching_category_codes(match_string)
+        if not mask.any():
+            return []
+        entry_mask = mask[self.business_category]
+        owners = numpy.repeat(numpy.arange(self.business_count),
+                              numpy.diff(self.business_category_start))
+        return owners[entry_mask].tolist()
+
+    #Review queries, the same interface as ReviewIndex
+
+    def get_review_rows(self, ids):
+        """Return the row numbers of reviews for the given business IDs, in file order"""
+        codes = [self.business_codes[business_id] for business_id in set(ids)
+                 if business_id in self.business_codes]
+        if not codes:
+            return numpy.array([], dtype=numpy.int64)
+        return numpy.flatnonzero(numpy.isin(self.review_business, codes))
+
+    def get_review_columns(self, ids):
+        """Return (stars, dates) arrays of the reviews for the given business IDs"""
+        rows = self.get_review_rows(ids)
+        return self.review_stars[rows], self.review_date[rows]
+
+    def iter_reviews_by_ids(self, ids):
+        """Yield only the review lines for the given IDs, in file order"""
+        rows = self.get_review_rows(ids)
+        if len(rows) == 0:
+            return
+        with open(self.review_source, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for row in rows:
+                    offset = int(self.review_offset[row])
+                    length = int(self.review_length[row])
+                    yield json.loads(mm[offset:offset + length])
+
+    def get_reviews_by_ids(self, ids):
+        """Read only the review lines for the given IDs, in file order"""
+        return list(self.iter_reviews_by_ids(ids))
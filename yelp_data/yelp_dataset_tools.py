@@ -4,8 +4,16 @@ Description: tools for working with Yelp Dataset Challenge JSON files
 Bugs: Parsing the reviews file is very slow; optimization needed
 """
 
+import bisect
+import collections
+import gzip
 import json
+import mmap
+import multiprocessing
+import os
 import pickle
+import re
+from array import array
 
 #replace this with the directory of your business JSON file
 
@@ -16,55 +24,303 @@ business_path = yelp_path + 'yelp_academic_dataset_business.json'
 #replace this with the directory of your review JSON file
 review_path = yelp_path + 'yelp_academic_dataset_review.json'
 
+#Matches the business_id field of a raw review line
+#Quotes inside other string values are escaped, so this can't match inside the review text
+BUSINESS_ID_PATTERN = re.compile(rb'"business_id"\s*:\s*"([^"]*)"')
+
 class YelpParser:
     def __init__(self, source_path):
         self.source = source_path
 
+class BusinessIndex:
+    """In-memory index of a Yelp business JSON file, built in a single pass"""
+    def __init__(self, source_path):
+        self.source = source_path
+        #Raw JSON line, business ID and category list for each business, in file order
+        self.lines = []
+        self.business_ids = []
+        self.business_categories = []
+        #{category: count}
+        self.category_counts = {}
+        #{category: [positions of businesses having that category]}
+        self.category_index = {}
+        #{match_string: frozenset of category names containing match_string}
+        self.match_cache = {}
+        self.build()
+
+    def build(self):
+        """Read the business JSON once, decoding each line only once"""
+        with open(self.source) as f:
+            for line in f:
+                business = json.loads(line)
+                position = len(self.lines)
+                cats = business['categories'] or []
+                self.lines.append(line)
+                self.business_ids.append(business['business_id'])
+                self.business_categories.append(cats)
+                for cat in cats:
+                    self.category_counts[cat] = self.category_counts.get(cat, 0) + 1
+                    self.category_index.setdefault(cat, []).append(position)
+
+    def matching_category_names(self, match_string):
+        """Return the set of category names that contain match_string"""
+        if match_string not in self.match_cache:
+            self.match_cache[match_string] = frozenset(
+                cat for cat in self.category_counts if match_string in cat)
+        return self.match_cache[match_string]
+
+    def matching_positions(self, match_string):
+        """Return positions of businesses with a category matching match_string
+        A business appears once per matching category, in file order,
+        the same way find_matching_categories has always reported them
+        """
+        cats = self.matching_category_names(match_string)
+        positions = set()
+        for cat in cats:
+            positions.update(self.category_index[cat])
+        matches = []
+        for position in sorted(positions):
+            for cat in self.business_categories[position]:
+                if cat in cats:
+                    matches.append(position)
+        return matches
+
+
 class BusinessParser(YelpParser):
     """Class for parsing JSON of Yelp businesses"""
-    def __init__(self, source_path):
+    def __init__(self, source_path, cache=None):
         YelpParser.__init__(self, source_path)
+        #A loaded yelp_cache.ColumnCache can be used in place of the BusinessIndex
+        self.index = cache
+
+    def get_index(self):
+        """Build the BusinessIndex on first use, so the file is only read once"""
+        if self.index is None:
+            self.index = BusinessIndex(self.source)
+        return self.index
 
     def find_matching_categories(self, match_string):
         """Find businesses in JSON having at least one category matching the match_string"""
-        #input: list of lines of Yelp business info, each a JSON object
-        #Note: I did readlines() instead of json.load because it's quite large
+        #input: string to match in category
         #output: list of JSON lines that include 'match' in category attribute
-
-        matches = []
-        with open(self.source) as f:
-            for line in f:
-                cats = json.loads(line)['categories']
-                if cats:
-                    for cat in cats:
-                        if match_string in cat:
-                            matches.append(line)
-        return matches
+        index = self.get_index()
+        return [index.lines[position] for position in index.matching_positions(match_string)]
 
     def get_categories(self):
         """Return dict of all categories in the JSON, with their counts"""
         #Output: a dict of all the categories appearing in the dataset
-        category_dict = {}
-        with open(self.source) as f:
-            for line in f:
-                if json.loads(line)['categories']:
-                    for category in json.loads(line)['categories']:
-                        category_dict[category] = category_dict.get(category, 0) + 1
-        return category_dict
+        return dict(self.get_index().category_counts)
 
     def get_ids_for_category(self,  match_string):
         """Return list of all IDs of business having category matching match_string"""
         #input: string to match in category
         #output: list of business IDs
         #note: we use this to search the reviews later
-        matches = self.find_matching_categories(match_string)
-        return [json.loads(match)['business_id'] for match in matches]
+        index = self.get_index()
+        return [index.business_ids[position] for position in index.matching_positions(match_string)]
+
+
+def split_lines(source_path, chunks):
+    """Split a file into (start, end) byte ranges that begin and end on line boundaries"""
+    #Input: file path, number of ranges wanted
+    #Output: list of (start, end) tuples covering the whole file, in order
+    size = os.path.getsize(source_path)
+    bounds = [0]
+    with open(source_path, 'rb') as f:
+        for i in range(1, chunks):
+            f.seek(max(size * i // chunks, bounds[-1]))
+            #Move forward to the start of the next line
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+def get_business_id(line):
+    """Get the business ID of a raw review line without decoding the whole review"""
+    #Input: one line of the review file, as bytes
+    #Output: the business ID string (None if it is missing or null)
+    match = BUSINESS_ID_PATTERN.search(line)
+    if match is None or b'\\' in match.group(1):
+        #Unusual formatting or escaped characters, so let json handle it
+        return json.loads(line)['business_id']
+    return match.group(1).decode('utf-8')
+
+def iter_review_lines(source_path, start, end, ids):
+    """Yield the raw lines of reviews matching given IDs from one byte range of the review file"""
+    #Input: review file path, start offset, end offset, business IDs
+    #Output: generator of review lines (bytes) in that range for the given IDs, in file order
+    with open(source_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            business_id = get_business_id(line)
+            if business_id:
+                if business_id in ids:
+                    yield line
+
+def iter_review_range(source_path, start, end, ids):
+    """Yield reviews matching given IDs from one byte range of the review file"""
+    #Input: review file path, start offset, end offset, business IDs
+    #Output: generator of reviews in that range for the given IDs, in file order
+    #Only decode the reviews we're keeping
+    for line in iter_review_lines(source_path, start, end, ids):
+        yield json.loads(line)
+
+def scan_review_range(task):
+    """Get the raw lines of reviews matching given IDs from one byte range of the review file"""
+    #Input: (review file path, start offset, end offset, business IDs)
+    #Output: list of review lines (bytes) in that range for the given IDs, in file order
+    #This is module-level so that multiprocessing can pickle it
+    #Lines are much cheaper to send back to the parent than decoded dicts
+    return list(iter_review_lines(*task))
+
+def open_output(dest, compression=None):
+    """Open dest for writing text, optionally compressed with gzip or zstd"""
+    if compression is None:
+        return open(dest, 'w', encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(dest, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        #zstandard is only needed if you ask for zstd output
+        import zstandard
+        return zstandard.open(dest, 'wt', encoding='utf-8')
+    raise ValueError("Unknown compression: {0}".format(compression))
+
+
+class ReviewIndex:
+    """Sidecar index mapping business IDs to the byte ranges of their reviews
+    The index is stored next to the review file as sorted arrays and is only
+    valid while the review file keeps the same mtime and size
+    """
+    version = 1
+
+    def __init__(self, source_path, index_path=None):
+        self.source = source_path
+        self.index_path = index_path or source_path + '.idx'
+        #Sorted list of business IDs
+        self.business_ids = []
+        #starts[i]:starts[i+1] is the slice of offsets/lengths for business_ids[i]
+        self.starts = array('q')
+        #Byte offset and length of each review line, grouped by business, in file order
+        self.offsets = array('q')
+        self.lengths = array('q')
+
+    def source_stamp(self):
+        """Return the (mtime, size) of the review file, used to invalidate the index"""
+        stat = os.stat(self.source)
+        return stat.st_mtime_ns, stat.st_size
+
+    def build(self):
+        """Scan the review file once and record where each business's reviews are"""
+        ranges = {} #{business_id: (array of offsets, array of lengths)}
+        offset = 0
+        with open(self.source, 'rb') as f:
+            for line in f:
+                business_id = get_business_id(line)
+                if business_id:
+                    if business_id not in ranges:
+                        ranges[business_id] = (array('q'), array('q'))
+                    ranges[business_id][0].append(offset)
+                    ranges[business_id][1].append(len(line))
+                offset += len(line)
+
+        self.business_ids = sorted(ranges)
+        self.starts = array('q', [0])
+        self.offsets = array('q')
+        self.lengths = array('q')
+        for business_id in self.business_ids:
+            offsets, lengths = ranges[business_id]
+            self.offsets.extend(offsets)
+            self.lengths.extend(lengths)
+            self.starts.append(len(self.offsets))
+        return self
+
+    def save(self):
+        """Write the index to its sidecar file"""
+        mtime, size = self.source_stamp()
+        with open(self.index_path, 'wb') as dest:
+            pickle.dump({
+                'version': self.version,
+                'mtime': mtime,
+                'size': size,
+                'business_ids': self.business_ids,
+                'starts': self.starts.tobytes(),
+                'offsets': self.offsets.tobytes(),
+                'lengths': self.lengths.tobytes(),
+            }, dest, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        """Load the sidecar file, returning False if it is missing or stale"""
+        try:
+            with open(self.index_path, 'rb') as source:
+                stored = pickle.load(source)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if stored.get('version') != self.version:
+            return False
+        if (stored['mtime'], stored['size']) != self.source_stamp():
+            return False
+        self.business_ids = stored['business_ids']
+        self.starts = array('q')
+        self.starts.frombytes(stored['starts'])
+        self.offsets = array('q')
+        self.offsets.frombytes(stored['offsets'])
+        self.lengths = array('q')
+        self.lengths.frombytes(stored['lengths'])
+        return True
+
+    def get_ranges(self, ids):
+        """Return sorted (offset, length) pairs of the reviews for the given IDs"""
+        ranges = []
+        for business_id in set(ids):
+            i = bisect.bisect_left(self.business_ids, business_id)
+            if i < len(self.business_ids) and self.business_ids[i] == business_id:
+                for j in range(self.starts[i], self.starts[i + 1]):
+                    ranges.append((self.offsets[j], self.lengths[j]))
+        ranges.sort()
+        return ranges
+
+    def iter_reviews_by_ids(self, ids):
+        """Yield only the review lines for the given IDs, in file order"""
+        ranges = self.get_ranges(ids)
+        if not ranges:
+            return
+        with open(self.source, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset, length in ranges:
+                    yield json.loads(mm[offset:offset + length])
+
+    def get_reviews_by_ids(self, ids):
+        """Read only the review lines for the given IDs, in file order"""
+        return list(self.iter_reviews_by_ids(ids))
 
 
 class ReviewParser(YelpParser):
     """Class for working with JSON of yelp reviews"""
-    def __init__(self, source_path):
+    def __init__(self, source_path, index_path=None, cache=None):
         YelpParser.__init__(self, source_path)
+        self.index_path = index_path
+        #A loaded yelp_cache.ColumnCache can be used in place of the ReviewIndex
+        self.index = cache
+
+    def load_index(self):
+        """Load the review index if a fresh one exists on disk, otherwise return None"""
+        if self.index is None:
+            index = ReviewIndex(self.source, self.index_path)
+            if index.load():
+                self.index = index
+        return self.index
+
+    def get_index(self):
+        """Load the review index, building and saving it first if needed"""
+        if self.load_index() is None:
+            self.index = ReviewIndex(self.source, self.index_path).build()
+            self.index.save()
+        return self.index
 
     def get_data_from_json(self):
         """Load data from source path as a JSON data object"""
@@ -75,18 +331,42 @@ class ReviewParser(YelpParser):
             data = json.load(f)
         return data
 
-    def get_reviews_by_ids(self, ids):
+    def get_reviews_by_ids(self, ids, use_index=True, workers=1):
         """Get reviews matching given IDs"""
-        #Input: business IDS
+        #Input: business IDS, number of worker processes for a full scan
         #output list reviews for given IDs, each as JSON object
-        reviews = []
-        with open(self.source) as f:
-             for line in f:
-                 line_data = json.loads(line)
-                 if line_data['business_id']:
-                     if line_data['business_id'] in ids:
-                         reviews.append(line_data)
-        return reviews
+        return list(self.iter_reviews_by_ids(ids, use_index, workers))
+
+    def iter_reviews_by_ids(self, ids, use_index=True, workers=1):
+        """Yield reviews matching given IDs, one at a time, in file order"""
+        #Same as get_reviews_by_ids, but only a few reviews are held in memory at once
+        #If a fresh index exists (see get_index), only the matching lines are read
+        ids = frozenset(ids)
+        if use_index and self.load_index() is not None:
+            return self.index.iter_reviews_by_ids(ids)
+        if workers > 1:
+            return self.scan_parallel(ids, workers)
+        return iter_review_range(self.source, 0, os.path.getsize(self.source), ids)
+
+    def scan_parallel(self, ids, workers):
+        """Scan the review file with a pool of worker processes
+        The file is split on line boundaries into a few ranges per worker,
+        and the results are yielded back in file order. Only a couple of
+        ranges per worker are in flight at once, so memory stays bounded.
+        Workers send back the matching lines, which are decoded here.
+        """
+        tasks = [(self.source, start, end, ids)
+                 for start, end in split_lines(self.source, workers * 4)]
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.apply_async(scan_review_range, (task,)))
+                if len(pending) >= workers * 2:
+                    for line in pending.popleft().get():
+                        yield json.loads(line)
+            while pending:
+                for line in pending.popleft().get():
+                    yield json.loads(line)
 
     def pickle_reviews(self, reviews, dest):
         #Input: list of Yelp reviews, each as a JSON object, destination file
@@ -94,12 +374,32 @@ class ReviewParser(YelpParser):
         with open(dest, 'wb') as p:
             pickle.dump(reviews, p)
 
-    def write_to_json(self, reviews, dest):
-        #Input: list of Yelp reviews, each as  a JSON object
-        #output: JSON file
-        #Note that it is *not* advisable to do this line by line, you have to dump the whole thing
-        with open(dest, 'w') as dest:
-             json.dump(reviews, dest, indent=2)
+    def write_to_json(self, reviews, dest, compression=None):
+        """Write reviews to dest as a JSON array, one review at a time"""
+        #Input: iterable of Yelp reviews, each as a JSON object, optional 'gzip' or 'zstd'
+        #output: JSON file, same layout as json.dump(reviews, indent=2)
+        #Returns the number of reviews written
+        count = 0
+        with open_output(dest, compression) as out:
+            for review in reviews:
+                out.write(',\n' if count else '[\n')
+                out.write('  ' + json.dumps(review, indent=2).replace('\n', '\n  '))
+                count += 1
+            out.write('\n]' if count else '[]')
+        return count
+
+    def write_to_jsonl(self, reviews, dest, compression=None):
+        """Write reviews to dest as JSON Lines, one review per line"""
+        #Input: iterable of Yelp reviews, each as a JSON object, optional 'gzip' or 'zstd'
+        #Output: JSON Lines file, the same format as the Yelp review file
+        #Returns the number of reviews written
+        count = 0
+        with open_output(dest, compression) as out:
+            for review in reviews:
+                out.write(json.dumps(review))
+                out.write('\n')
+                count += 1
+        return count
 
 def parser_demo(query):
     #Create BusinessParser object
@@ -123,19 +423,23 @@ def parser_demo(query):
     #We'll use this to search the reviews
     rp = ReviewParser(review_path)
 
+    #Build the review index the first time, so later queries skip the full scan
+    rp.get_index()
+
     #Get reviews of businesses with IDs we found earlier
-    matching_reviews = rp. get_reviews_by_ids(matching_ids)
-    print("Found {0} reviews for {1} businesses".format(len(matching_reviews), query))
+    #This is a generator, so the reviews are written out as they're found
+    matching_reviews = rp.iter_reviews_by_ids(matching_ids)
 
     #Pickle the reviews so they're easier to retrieve later
     #pickle_path = query.lower().replace(' ', '_') + '_reviews.pickle'
-    #rp.pickle_reviews(matching_reviews, pickle_path)
+    #rp.pickle_reviews(rp.get_reviews_by_ids(matching_ids), pickle_path)
     #print("Pickled reviews to {0}".format(pickle_path))
 
     #Save the reviews to a JSON file
     json_path = query.lower().replace(' ', '_') + '_reviews.json'
-    rp.write_to_json(matching_reviews, json_path)
-    print("Wrote {0} reviews to {0}".format(query, json_path))
+    review_count = rp.write_to_json(matching_reviews, json_path)
+    print("Found {0} reviews for {1} businesses".format(review_count, query))
+    print("Wrote {0} reviews to {1}".format(query, json_path))
 
     #Create a JSON data object that we can play with
     #mr = ReviewParser(json_path)